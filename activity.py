@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+import logging
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+def day_key(day):
+    return day.isoformat()
+
+
+def week_key(day):
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+class ActivityTracker:
+    """Write-behind `last_active` tracking with daily and weekly unique-active rollups.
+
+    Handlers only add the user id to an in-memory set. Every `flush_interval`
+    seconds the set is written out, filtered on the stored `last_active`:
+    users not yet seen this week, then users not yet seen today. The modified
+    counts are exactly the new weekly and daily actives, which are added to
+    the rollup documents. Nothing is written for users already seen today.
+    """
+
+    def __init__(self, users_col, rollups_col, flush_interval=5):
+        self.users_col = users_col
+        self.rollups_col = rollups_col
+        self.flush_interval = flush_interval
+        self._pending = set()
+        self._seen_today = set()
+        self._created = 0
+        self._day = datetime.date.today()
+        self._wake = asyncio.Event()
+        self._running = False
+        self._task = None
+
+    # --- RECORDING ---
+
+    def touch(self, user_id):
+        if user_id not in self._seen_today:
+            self._pending.add(user_id)
+
+    def on_user_created(self, user_id):
+        # Created with last_active = now, so the filters below would never count them
+        self._created += 1
+        self._seen_today.add(user_id)
+
+    # --- FLUSH ---
+
+    async def flush(self):
+        today = datetime.date.today()
+        if today != self._day:
+            self._seen_today = set()
+            self._day = today
+        ids, self._pending = list(self._pending), set()
+        created, self._created = self._created, 0
+        if not ids and not created:
+            return
+
+        now = datetime.datetime.now()
+        today_start = datetime.datetime.combine(today, datetime.time.min)
+        week_start = today_start - datetime.timedelta(days=today.weekday())
+        new_week = new_day = created
+        try:
+            if ids:
+                # Ordered on purpose: the weekly pass moves last_active past both cut-offs
+                week = await self.users_col.update_many(
+                    {'user_id': {'$in': ids}, 'last_active': {'$lt': week_start}},
+                    {'$set': {'last_active': now}}
+                )
+                day = await self.users_col.update_many(
+                    {'user_id': {'$in': ids}, 'last_active': {'$lt': today_start}},
+                    {'$set': {'last_active': now}}
+                )
+                new_week += week.modified_count
+                new_day += week.modified_count + day.modified_count
+            self._seen_today.update(ids)
+            if new_day or new_week:
+                await self.rollups_col.bulk_write([
+                    UpdateOne({'_id': f"day:{day_key(today)}"},
+                              {'$inc': {'active': new_day}, '$setOnInsert': {'kind': 'day', 'start': today_start}},
+                              upsert=True),
+                    UpdateOne({'_id': f"week:{week_key(today)}"},
+                              {'$inc': {'active': new_week}, '$setOnInsert': {'kind': 'week', 'start': week_start}},
+                              upsert=True),
+                ], ordered=False)
+        except Exception as e:
+            # Put them back; the last_active filters keep a retry from counting anyone twice
+            self._pending.update(ids)
+            self._created += created
+            logger.error(f"Activity flush of {len(ids)} user(s) failed: {e}")
+
+    async def _flush_loop(self):
+        while self._running:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._running = True
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            # Woken rather than cancelled, so a flush is never cut off halfway
+            self._running = False
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    # --- READ ---
+
+    async def active_counts(self):
+        """Return (daily actives, weekly actives) from the rollups, pending users not included."""
+        today = datetime.date.today()
+        docs = {}
+        async for doc in self.rollups_col.find({'_id': {'$in': [f"day:{day_key(today)}", f"week:{week_key(today)}"]}}):
+            docs[doc['kind']] = doc.get('active', 0)
+        return docs.get('day', 0), docs.get('week', 0)
@@ -0,0 +1,150 @@
+import asyncio
+import datetime
+import logging
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+# Cold documents per hot collection: what qualifies, which date picks the month,
+# and the indexes every monthly archive gets
+ARCHIVES = {
+    'coupons': {
+        'date_field': 'used_at',
+        'filter': lambda cutoff: {'is_used': True, 'used_at': {'$lt': cutoff}},
+        'indexes': [IndexModel([('code', ASCENDING)], unique=True)],
+    },
+    'redeemed': {
+        'date_field': 'redeemed_at',
+        'filter': lambda cutoff: {'redeemed_at': {'$lt': cutoff}},
+        'indexes': [IndexModel([('user_id', ASCENDING), ('redeemed_at', DESCENDING)])],
+    },
+}
+
+
+def archive_name(collection, when):
+    return f"{collection}_archive_{when:%Y_%m}"
+
+
+class Archiver:
+    """Moves used coupons and old redemptions into monthly archive collections.
+
+    Each batch is copied with idempotent upserts, registered in
+    `archive_state`, and only then deleted from the hot collection, so a run
+    that dies halfway is finished by the next one without losing or
+    duplicating anything. Readers that need history list the archives
+    through `sources()`.
+    """
+
+    def __init__(self, db, older_than_days=90, batch_size=1000, interval=3600, lease=None):
+        self.db = db
+        self.lease = lease
+        self.state_col = db['archive_state']
+        self.older_than_days = older_than_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._wake = asyncio.Event()
+        self._running = False
+        self._task = None
+
+    # --- LOOKUPS ---
+
+    async def archives(self, collection):
+        """Names of the monthly archives of a collection, oldest first."""
+        doc = await self.state_col.find_one({'_id': collection}, {'archives': 1})
+        return sorted(doc.get('archives', [])) if doc else []
+
+    async def sources(self, collection):
+        # Hot collection first, then its archives; collections without archives map to themselves
+        if collection not in ARCHIVES:
+            return [collection]
+        return [collection] + await self.archives(collection)
+
+    async def archived_total(self, collection):
+        doc = await self.state_col.find_one({'_id': collection}, {'archived': 1})
+        return doc.get('archived', 0) if doc else 0
+
+    async def archived_codes(self, codes):
+        """Coupon codes among `codes` that already live in an archive."""
+        names = await self.archives('coupons')
+        if not names or not codes:
+            return set()
+        found = await asyncio.gather(*(
+            self.db[name].find({'code': {'$in': codes}}, {'_id': 0, 'code': 1}).to_list(length=None)
+            for name in names
+        ))
+        return {doc['code'] for docs in found for doc in docs}
+
+    # --- MOVING ---
+
+    async def _register(self, collection, name):
+        await self.db[name].create_indexes(ARCHIVES[collection]['indexes'])
+        await self.state_col.update_one({'_id': collection}, {'$addToSet': {'archives': name}}, upsert=True)
+
+    async def archive_collection(self, collection, cutoff):
+        spec = ARCHIVES[collection]
+        source = self.db[collection]
+        query = spec['filter'](cutoff)
+        registered = set(await self.archives(collection))
+        moved = 0
+        while True:
+            batch = await source.find(query).sort(spec['date_field'], ASCENDING).limit(self.batch_size).to_list(length=None)
+            if not batch:
+                break
+            by_month = {}
+            for doc in batch:
+                by_month.setdefault(archive_name(collection, doc[spec['date_field']]), []).append(doc)
+            for name, docs in by_month.items():
+                if name not in registered:
+                    # Registered before anything lands in it, so readers never miss a month
+                    await self._register(collection, name)
+                    registered.add(name)
+                await self.db[name].bulk_write([ReplaceOne({'_id': d['_id']}, d, upsert=True) for d in docs], ordered=False)
+            # Re-checked against the filter: only ever removes what was just copied
+            result = await source.delete_many({'_id': {'$in': [d['_id'] for d in batch]}, **query})
+            await self.state_col.update_one({'_id': collection}, {'$inc': {'archived': result.deleted_count}}, upsert=True)
+            moved += result.deleted_count
+            if self._task is not None and not self._running:
+                # stop() was called; the rest waits for the next run
+                break
+        return moved
+
+    async def run_once(self):
+        """Archive everything older than `older_than_days`; returns {collection: moved}."""
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=self.older_than_days)
+        moved = {}
+        for collection in ARCHIVES:
+            moved[collection] = await self.archive_collection(collection, cutoff)
+            if moved[collection]:
+                logger.info(f"Archived {moved[collection]} {collection} document(s) older than {cutoff:%Y-%m-%d}")
+        return moved
+
+    # --- BACKGROUND JOB ---
+
+    async def _run(self):
+        while self._running:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if not self._running:
+                break
+            try:
+                # Another worker holds the lease: it runs the job this time
+                if self.lease and not await self.lease.acquire():
+                    continue
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Archive run failed: {e}")
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._running = True
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            # Woken rather than cancelled; a batch in flight finishes before the job exits
+            self._running = False
+            self._wake.set()
+            await self._task
+            self._task = None
@@ -0,0 +1,90 @@
+"""Updates per second with sequential vs concurrent update processing.
+
+    python benchmarks/concurrent_updates.py --updates 2000 --concurrency 32
+
+Handlers sleep for --db-latency (standing in for Mongo round trips) and reply
+through a fake Bot API with --api-latency. The run also checks that each
+user's updates were handled in the order they arrived.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram.ext import ApplicationBuilder, MessageHandler, filters  # noqa: E402
+from concurrency import UserOrderedUpdateProcessor  # noqa: E402
+from fake_telegram import FakeBotAPI, message_update  # noqa: E402
+
+
+async def run_once(label, concurrency, args):
+    api = FakeBotAPI(latency=args.api_latency)
+    builder = ApplicationBuilder().token("1000:bench").request(api).updater(None)
+    if concurrency > 1:
+        builder = builder.concurrent_updates(UserOrderedUpdateProcessor(concurrency))
+    application = builder.build()
+
+    seen = defaultdict(list)
+    done = asyncio.Event()
+    handled = 0
+
+    async def handler(update, context):
+        nonlocal handled
+        await asyncio.sleep(args.db_latency)
+        seen[update.effective_user.id].append(update.update_id)
+        await update.message.reply_text("ok")
+        handled += 1
+        if handled == args.updates:
+            done.set()
+
+    application.add_handler(MessageHandler(filters.ALL, handler))
+
+    rng = random.Random(args.seed)
+    async with application:
+        await application.start()
+        updates = []
+        for update_id in range(1, args.updates + 1):
+            # A handful of hot users plus a long tail, like menu-button spam
+            user_id = rng.randint(1, 10) if rng.random() < 0.3 else rng.randint(11, args.users)
+            updates.append(message_update(application.bot, update_id, user_id, "💎 Balance"))
+
+        started = time.perf_counter()
+        for update in updates:
+            await application.update_queue.put(update)
+        await done.wait()
+        elapsed = time.perf_counter() - started
+        await application.stop()
+
+    ordered = all(ids == sorted(ids) for ids in seen.values())
+    print(f"{label:<24} {args.updates / elapsed:>10.0f} upd/s   {elapsed:>7.2f}s   per-user order kept: {ordered}")
+    return ordered
+
+
+async def run(args):
+    print(f"{args.updates} updates, {args.users} users, db latency {args.db_latency * 1000:.0f}ms, "
+          f"api latency {args.api_latency * 1000:.0f}ms")
+    results = [await run_once("sequential", 1, args)]
+    for concurrency in args.concurrency:
+        results.append(await run_once(f"concurrent ({concurrency})", concurrency, args))
+    if not all(results):
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--db-latency", type=float, default=0.005)
+    parser.add_argument("--api-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""A local stand-in for the Bot API, so benchmarks run without a token or network.
+
+Plug it into an Application with ApplicationBuilder().request(FakeBotAPI(...)).
+Every call is counted per endpoint and can be given an artificial latency.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+BOT_USER = {
+    'id': 1000, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+    'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False,
+}
+
+
+class FakeBotAPI(BaseRequest):
+    def __init__(self, latency=0.0, member_status="member"):
+        self.latency = latency
+        self.member_status = member_status
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params, text=None):
+        chat_id = params.get('chat_id', 0)
+        return {
+            'message_id': params.get('message_id') or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if isinstance(chat_id, int) and chat_id > 0 else 'channel'},
+            'from': BOT_USER,
+            'text': text if text is not None else params.get('text', ''),
+        }
+
+    def _result(self, endpoint, params):
+        if endpoint == 'getMe':
+            return BOT_USER
+        if endpoint == 'getChatMember':
+            user = {'id': params.get('user_id'), 'is_bot': False, 'first_name': 'User'}
+            return {'status': self.member_status, 'user': user}
+        if endpoint == 'getChat':
+            return {'id': params.get('chat_id'), 'type': 'channel', 'title': 'Channel',
+                    'invite_link': 'https://t.me/+bench'}
+        if endpoint in ('sendMessage', 'editMessageText', 'copyMessage', 'sendDocument'):
+            if endpoint == 'copyMessage':
+                return {'message_id': next(self._message_ids)}
+            return self._message(params)
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = {}
+        if request_data:
+            for key, value in request_data.parameters.items():
+                try:
+                    params[key] = json.loads(value) if isinstance(value, str) else value
+                except ValueError:
+                    params[key] = value
+        payload = {'ok': True, 'result': self._result(endpoint, params)}
+        return 200, json.dumps(payload).encode()
+
+
+# --- SYNTHETIC UPDATES ---
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"}
+
+
+def message_update(bot, update_id, user_id, text):
+    message = {
+        'message_id': update_id, 'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'}, 'from': _user(user_id), 'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return Update.de_json({'update_id': update_id, 'message': message}, bot)
+
+
+def callback_update(bot, update_id, user_id, data):
+    message = {
+        'message_id': update_id, 'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'}, 'from': BOT_USER, 'text': '...',
+    }
+    query = {'id': str(update_id), 'from': _user(user_id), 'chat_instance': str(user_id),
+             'message': message, 'data': data}
+    return Update.de_json({'update_id': update_id, 'callback_query': query}, bot)
@@ -0,0 +1,244 @@
+"""Replay synthetic traffic through the bot's real handlers and report the cost per update.
+
+    python benchmarks/load_test.py --mongo-uri mongodb://localhost:27017
+    python benchmarks/load_test.py --in-memory   # smoke run, no server
+
+The Application comes from main.build_application(), so every handler, cache
+and background job runs as in production; only the Bot API is replaced by
+benchmarks/fake_telegram.py. Each workload reports throughput, p50/p99 latency
+(from arrival on the update queue to the last handler finishing) and the Mongo
+commands and Bot API calls spent per update.
+
+With --in-memory, mongomock scans every document on each query, so throughput
+and latency mostly measure the mock; the per-update op and call counts still hold.
+
+Uses (and drops) its own database, never the bot's.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeBotAPI, message_update, callback_update  # noqa: E402
+
+WORKLOADS = ("referral_burst", "redemption_storm", "menu_spam")
+
+
+def configure(args):
+    # main reads its config at import time, so this has to run first
+    os.environ.update({
+        "BOT_TOKEN": "1000:bench",
+        "MONGO_URI": args.mongo_uri,
+        "MONGO_DB_NAME": args.db,
+        "FSUB_CHANNEL_IDS": ",".join(str(-1001000000000 - i) for i in range(args.channels)),
+        "CONCURRENT_UPDATES": str(args.concurrency),
+        "COUPON_POOL_SIZE": str(args.pool_size),
+        "LOG_CHANNEL_ID": "0",
+    })
+    if not args.throttle:
+        # The workloads replay a few hot users far faster than any person taps;
+        # flood control would shed them and hide the handler cost being measured
+        os.environ.update({"THROTTLE_MENU_RATE": "0", "THROTTLE_ACTION_RATE": "0"})
+    if args.in_memory:
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+        motor.motor_asyncio.AsyncIOMotorClient = lambda *a, **kw: AsyncMongoMockClient()
+        # mongomock has no replica set, so transactions are off the table
+        os.environ["REDEMPTION_MODE"] = "compensate"
+
+
+class OpCounter:
+    """Counts Mongo commands: from the driver's listener, or by wrapping mongomock."""
+
+    def __init__(self, in_memory, latency):
+        self.ops = 0
+        if in_memory:
+            self._wrap_mongomock(latency)
+        else:
+            from metrics import MONGO_LATENCY
+            self._histogram = MONGO_LATENCY
+
+    def _wrap_mongomock(self, latency):
+        import mongomock_motor
+        collection_cls = mongomock_motor.AsyncMongoMockCollection
+        counter = self
+
+        def count_async(name):
+            original = getattr(collection_cls, name)
+
+            async def wrapper(self, *args, **kwargs):
+                counter.ops += 1
+                if latency:
+                    await asyncio.sleep(latency)
+                return await original(self, *args, **kwargs)
+            setattr(collection_cls, name, wrapper)
+
+        def count_cursor(name):
+            original = getattr(collection_cls, name)
+
+            def wrapper(self, *args, **kwargs):
+                counter.ops += 1
+                return original(self, *args, **kwargs)
+            setattr(collection_cls, name, wrapper)
+
+        for name in ("find_one", "find_one_and_update", "insert_one", "insert_many", "update_one",
+                     "update_many", "delete_many", "bulk_write", "count_documents",
+                     "estimated_document_count"):
+            count_async(name)
+        for name in ("find", "aggregate"):
+            count_cursor(name)
+        self._histogram = None
+
+    def total(self):
+        return self._histogram.total_count() if self._histogram else self.ops
+
+
+def time_updates(application):
+    """Record when each update finishes processing, keyed by update_id."""
+    finished = {}
+    processor_cls = type(application.update_processor)
+    original = processor_cls.process_update
+
+    async def process_update(self, update, coroutine):
+        try:
+            await original(self, update, coroutine)
+        finally:
+            finished[update.update_id] = time.perf_counter()
+    processor_cls.process_update = process_update
+    return finished
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+# --- WORKLOADS ---
+
+class Workload:
+    def __init__(self, main, args, rng):
+        self.main = main
+        self.args = args
+        self.rng = rng
+        self.referrers = list(range(1, 21))
+        self.members = list(range(1_000, 1_000 + args.users))
+        self.next_new_user = 1_000_000
+        self.next_update_id = 1
+
+    async def seed(self):
+        main = self.main
+        await main.users_col.insert_many([
+            {'user_id': uid, 'first_name': f"User{uid}", 'balance': float(self.args.balance),
+             'referral_count': 0, 'redeemed_count': 0, 'recent_redemptions': [],
+             'referred_by': None, 'joined_date': main.datetime.datetime.now(), 'is_banned': False}
+            for uid in self.referrers + self.members
+        ])
+        await main.coupons_col.insert_many([
+            {'code': f"B{amount}-{i}", 'amount': amount, 'is_used': False, 'used_by': None, 'used_at': None}
+            for amount in main.COUPON_COSTS for i in range(self.args.coupons)
+        ])
+
+    def referral_burst(self, bot, update_id):
+        # A shared invite link going viral: every update is a first-time /start
+        self.next_new_user += 1
+        return message_update(bot, update_id, self.next_new_user, f"/start {self.rng.choice(self.referrers)}")
+
+    def redemption_storm(self, bot, update_id):
+        # Hot users double-tapping the cheapest coupon, plus the occasional bigger one
+        user_id = self.rng.choice(self.members[:10]) if self.rng.random() < 0.3 else self.rng.choice(self.members)
+        amount = self.rng.choice([500, 500, 500, 1000])
+        return callback_update(bot, update_id, user_id, f"redeem_{amount}")
+
+    def menu_spam(self, bot, update_id):
+        user_id = self.rng.choice(self.members)
+        text = self.rng.choice(["💎 Balance", "💎 Balance", "🎟 Coupon Stock", "🔗 My Link"])
+        return message_update(bot, update_id, user_id, text)
+
+
+async def run_workload(name, application, workload, finished, op_counter, api, args):
+    update_ids = range(workload.next_update_id, workload.next_update_id + args.updates)
+    workload.next_update_id += args.updates
+    updates = [getattr(workload, name)(application.bot, update_id) for update_id in update_ids]
+
+    arrived = {}
+    ops_before = op_counter.total()
+    calls_before = sum(api.calls.values())
+    interval = 1 / args.rate if args.rate else 0
+    started = time.perf_counter()
+    for i, update in enumerate(updates):
+        if interval:
+            # Open loop: arrivals keep their schedule no matter how far behind the bot falls
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        arrived[update.update_id] = time.perf_counter()
+        await application.update_queue.put(update)
+    while any(update_id not in finished for update_id in update_ids):
+        await asyncio.sleep(0.01)
+    elapsed = max(finished[update_id] for update_id in update_ids) - started
+
+    latencies = [(finished[update_id] - arrived[update_id]) * 1000 for update_id in update_ids]
+    ops = (op_counter.total() - ops_before) / args.updates
+    calls = (sum(api.calls.values()) - calls_before) / args.updates
+    print(f"{name:<18} {args.updates / elapsed:>8.0f} upd/s   p50 {percentile(latencies, 50):>7.1f}ms   "
+          f"p99 {percentile(latencies, 99):>7.1f}ms   {ops:>5.2f} mongo ops/upd   {calls:>5.2f} api calls/upd")
+
+
+async def run(args):
+    import main
+    op_counter = OpCounter(args.in_memory, args.db_latency)
+    api = FakeBotAPI(latency=args.api_latency)
+    application = main.build_application(request=api)
+    finished = time_updates(application)
+
+    await main.client.drop_database(main.db.name)
+    workload = Workload(main, args, random.Random(args.seed))
+    await workload.seed()
+
+    print(f"{args.updates} updates per workload at {args.rate or 'max'} upd/s, concurrency {args.concurrency}, "
+          f"{args.channels} fsub channel(s), {'in-memory' if args.in_memory else args.mongo_uri}")
+    await application.initialize()
+    await main.on_startup(application)
+    await application.start()
+    try:
+        for name in args.workloads:
+            await run_workload(name, application, workload, finished, op_counter, api, args)
+    finally:
+        await application.stop()
+        await main.on_stop(application)
+        await application.shutdown()
+        await main.on_shutdown(application)
+        await main.client.drop_database(main.db.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="bench_load")
+    parser.add_argument("--in-memory", action="store_true", help="Use mongomock-motor instead of a server")
+    parser.add_argument("--workloads", nargs="+", default=list(WORKLOADS), choices=WORKLOADS)
+    parser.add_argument("--updates", type=int, default=1000, help="Updates per workload")
+    parser.add_argument("--rate", type=float, default=300, help="Arrival rate in updates/s (0 = all at once)")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--balance", type=int, default=10)
+    parser.add_argument("--coupons", type=int, default=300, help="Coupons per denomination")
+    parser.add_argument("--channels", type=int, default=2, help="Force-subscribe channels")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--pool-size", type=int, default=20)
+    parser.add_argument("--db-latency", type=float, default=0.0, help="Added per Mongo call with --in-memory")
+    parser.add_argument("--api-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--throttle", action="store_true", help="Keep per-user flood control on")
+    args = parser.parse_args()
+    configure(args)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
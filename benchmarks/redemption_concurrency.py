@@ -0,0 +1,127 @@
+"""Fire hundreds of simultaneous redemptions and check the invariants.
+
+    python benchmarks/redemption_concurrency.py --mongo-uri mongodb://localhost:27017
+    python benchmarks/redemption_concurrency.py --in-memory   # smoke run, no server
+
+Uses (and drops) its own database, never the bot's.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indexes import ensure_indexes  # noqa: E402
+from redemption import RedemptionEngine  # noqa: E402
+from coupon_pool import CouponPool  # noqa: E402
+
+COUPON_COSTS = {500: 1, 1000: 5, 2000: 25, 4000: 35}
+
+
+def make_client(args):
+    if args.in_memory:
+        from mongomock_motor import AsyncMongoMockClient
+        return AsyncMongoMockClient()
+    import motor.motor_asyncio
+    return motor.motor_asyncio.AsyncIOMotorClient(args.mongo_uri)
+
+
+async def seed(db, args):
+    await db.client.drop_database(db.name)
+    await ensure_indexes(db)
+    await db.users.insert_many([
+        {'user_id': uid, 'balance': float(args.balance), 'referral_count': 0}
+        for uid in range(1, args.users + 1)
+    ])
+    await db.coupons.insert_many([
+        {'code': f"C{amount}-{i}", 'amount': amount, 'is_used': False, 'used_by': None, 'used_at': None}
+        for amount in COUPON_COSTS for i in range(args.coupons)
+    ])
+
+
+async def run(args):
+    client = make_client(args)
+    db = client[args.db]
+    await seed(db, args)
+    mode = "compensate" if args.in_memory else args.mode
+    pool = None
+    if args.pool_size:
+        pool = CouponPool(db.coupons, COUPON_COSTS.keys(), "bench", args.pool_size)
+        await pool.start()
+    engine = RedemptionEngine(client, db.users, db.coupons, db.redeemed, mode, pool)
+    await engine.uses_transactions()
+
+    rng = random.Random(args.seed)
+    # A few hot users double-tapping plus a spread of everyone else
+    jobs = []
+    for _ in range(args.requests):
+        uid = rng.randint(1, min(args.users, 5)) if rng.random() < 0.5 else rng.randint(1, args.users)
+        amount = rng.choice([500, 500, 500, 1000])
+        jobs.append((uid, COUPON_COSTS[amount], amount))
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(engine.redeem(uid, cost, amount) for uid, cost, amount in jobs))
+    elapsed = time.perf_counter() - started
+
+    statuses = Counter(status for _, _, status in results)
+    issued = [code for code, _, status in results if status == "success"]
+    spent = Counter()
+    for (uid, cost, _), (_, _, status) in zip(jobs, results):
+        if status == "success":
+            spent[uid] += cost
+
+    errors = []
+    if len(issued) != len(set(issued)):
+        errors.append("a coupon was issued twice")
+    negative = await db.users.count_documents({'balance': {'$lt': 0}})
+    if negative:
+        errors.append(f"{negative} user(s) with a negative balance")
+    async for user in db.users.find({}, {'user_id': 1, 'balance': 1}):
+        if abs(args.balance - spent[user['user_id']] - user['balance']) > 1e-9:
+            errors.append(f"user {user['user_id']} balance does not match their redemptions")
+            break
+    used = await db.coupons.count_documents({'is_used': True})
+    records = await db.redeemed.count_documents({})
+    if not used == records == len(issued):
+        errors.append(f"used coupons ({used}), redeemed records ({records}) and successes ({len(issued)}) differ")
+
+    if pool:
+        await pool.stop()
+        leaked = await db.coupons.count_documents({'reserved_by': {'$ne': None}})
+        if leaked:
+            errors.append(f"{leaked} reservation(s) left behind after release")
+
+    print(f"mode:        {'transaction' if await engine.uses_transactions() else 'compensate'}")
+    print(f"pool size:   {args.pool_size or 'off'}")
+    print(f"redemptions: {len(jobs)} in {elapsed:.3f}s ({len(jobs) / elapsed:.0f}/s)")
+    print(f"statuses:    {dict(statuses)}")
+    await client.drop_database(db.name)
+
+    if errors:
+        for error in errors:
+            print(f"❌ {error}")
+        sys.exit(1)
+    print("✅ No negative balances, no coupon issued twice.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="bench_redemption")
+    parser.add_argument("--in-memory", action="store_true", help="Use mongomock-motor instead of a server")
+    parser.add_argument("--mode", default="auto", choices=["auto", "transaction", "compensate"])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--balance", type=int, default=6)
+    parser.add_argument("--coupons", type=int, default=100, help="Coupons per denomination")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--pool-size", type=int, default=0, help="Pre-reserved coupons per denomination (0 = no pool)")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
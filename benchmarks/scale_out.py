@@ -0,0 +1,207 @@
+"""Throughput of the sharded mode (BOT_MODE=router) as the number of worker processes grows.
+
+    python benchmarks/scale_out.py --mongo-uri mongodb://localhost:27017 --workers 1 2 4
+    python benchmarks/scale_out.py --in-memory   # smoke run, no server
+
+Each worker is its own process running main.build_application() behind the
+same routed endpoint a real worker serves, with the Bot API replaced by
+benchmarks/fake_telegram.py. Updates go through router.UpdateRouter, so user
+sharding and per-shard batching are the production code paths. Throughput is
+measured from the first update submitted to the last one finishing on any
+worker, after a short warm-up.
+
+With --in-memory every worker has a private mongomock database (seeded the
+same way), so the numbers show how handler CPU spreads over cores rather than
+what a shared server can take.
+
+Uses (and drops) its own database, never the bot's.
+"""
+import argparse
+import asyncio
+import os
+import random
+import secrets
+import signal
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, ROOT)
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+from load_test import Workload, configure, time_updates  # noqa: E402
+
+WORKLOADS = ("menu_spam", "referral_burst")
+
+
+# --- WORKER PROCESS ---
+
+async def serve(args):
+    os.environ.update({"SHARD_INDEX": str(args.shard), "SHARD_COUNT": str(args.shard_count),
+                       "WORKER_ID": f"bench:shard{args.shard}"})
+    import main
+    from fake_telegram import FakeBotAPI
+    from webserver import build_web_app, start_web_server
+
+    application = main.build_application(request=FakeBotAPI(latency=args.api_latency))
+    finished = time_updates(application)
+    if args.in_memory:
+        await Workload(main, args, random.Random(args.seed)).seed()
+
+    web_app = build_web_app(application, routed_path=main.ROUTED_PATH, routed_secret=os.environ["ROUTED_SECRET"])
+
+    async def processed(request):
+        return web.json_response({'processed': len(finished)})
+
+    web_app.router.add_get('/bench/processed', processed)
+    stop_event = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
+
+    await application.initialize()
+    await main.on_startup(application)
+    await application.start()
+    runner = await start_web_server(web_app, args.port, host="127.0.0.1")
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        await application.stop()
+        await main.on_stop(application)
+        await application.shutdown()
+        await main.on_shutdown(application)
+
+
+# --- DRIVER ---
+
+def worker_command(args, shard, shard_count):
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--shard", str(shard),
+               "--shard-count", str(shard_count), "--port", str(args.base_port + shard)]
+    for name in ("mongo_uri", "db", "users", "balance", "coupons", "channels", "concurrency",
+                 "pool_size", "api_latency", "seed"):
+        command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    if args.in_memory:
+        command.append("--in-memory")
+    return command
+
+
+async def wait_ready(session, url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Worker at {url} did not come up")
+
+
+async def processed_total(session, urls):
+    async def one(url):
+        async with session.get(url) as response:
+            return (await response.json())['processed']
+    return sum(await asyncio.gather(*(one(url) for url in urls)))
+
+
+async def push(router, session, progress_urls, updates, done_before):
+    for update in updates:
+        router.submit(update)
+    while True:
+        done = await processed_total(session, progress_urls)
+        if done >= done_before + len(updates):
+            return done
+        await asyncio.sleep(0.05)
+
+
+async def measure(args, shard_count, name):
+    from router import UpdateRouter
+    output = None if args.verbose else asyncio.subprocess.DEVNULL
+    # Handed over the same way WorkerSupervisor does it
+    secret = secrets.token_urlsafe(32)
+    env = dict(os.environ, ROUTED_SECRET=secret)
+    processes = [await asyncio.create_subprocess_exec(*worker_command(args, shard, shard_count),
+                                                      stdout=output, stderr=output, env=env)
+                 for shard in range(shard_count)]
+    base = [f"http://127.0.0.1:{args.base_port + shard}" for shard in range(shard_count)]
+    router = UpdateRouter([f"{url}/routed" for url in base], secret)
+    try:
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(wait_ready(session, f"{url}/") for url in base))
+            await router.start()
+            workload = Workload(None, args, random.Random(args.seed))
+            make = getattr(workload, name)
+            updates = [make(None, update_id).to_dict() for update_id in range(1, args.warmup + args.updates + 1)]
+
+            progress_urls = [f"{url}/bench/processed" for url in base]
+            done = await push(router, session, progress_urls, updates[:args.warmup], 0)
+            # Timed from here, to within one 50ms progress poll
+            started = time.perf_counter()
+            await push(router, session, progress_urls, updates[args.warmup:], done)
+            return args.updates / (time.perf_counter() - started)
+    finally:
+        await router.stop()
+        for process in processes:
+            process.send_signal(signal.SIGTERM)
+        await asyncio.gather(*(process.wait() for process in processes))
+
+
+async def run(args):
+    if not args.in_memory:
+        # Shared database: seeded once here, the workers only read and write it
+        configure(args)
+        import main
+        await main.client.drop_database(main.db.name)
+        await Workload(main, args, random.Random(args.seed)).seed()
+
+    print(f"{args.updates} updates per run, concurrency {args.concurrency} per worker, "
+          f"{os.cpu_count()} CPU(s), {'in-memory' if args.in_memory else args.mongo_uri}")
+    for name in args.workloads:
+        baseline = None
+        for shard_count in args.workers:
+            rate = await measure(args, shard_count, name)
+            baseline = baseline or rate
+            print(f"{name:<16} {shard_count:>2} worker(s) {rate:>8.0f} upd/s   x{rate / baseline:.2f}")
+
+    if not args.in_memory:
+        await main.client.drop_database(main.db.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="bench_scale")
+    parser.add_argument("--in-memory", action="store_true", help="Use mongomock-motor instead of a server")
+    parser.add_argument("--workloads", nargs="+", default=list(WORKLOADS), choices=WORKLOADS)
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4], help="Worker counts to compare")
+    parser.add_argument("--updates", type=int, default=4000, help="Timed updates per run")
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--balance", type=int, default=10)
+    parser.add_argument("--coupons", type=int, default=300, help="Coupons per denomination")
+    parser.add_argument("--channels", type=int, default=2, help="Force-subscribe channels")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--pool-size", type=int, default=20)
+    parser.add_argument("--api-latency", type=float, default=0.02)
+    parser.add_argument("--base-port", type=int, default=18100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Show the workers' logs")
+    # Worker process mode, used by the driver
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--shard", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--shard-count", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.throttle = False
+
+    if args.serve:
+        configure(args)
+        asyncio.run(serve(args))
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import asyncio
+import datetime
+import logging
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastEngine:
+    """Copies one message to every user, paced under Telegram's global send limit.
+
+    Users are read in `user_id` order one page at a time, and the position and
+    counters are checkpointed on the broadcast document after every page, so a
+    restarted process resumes the job instead of messaging everyone again.
+    """
+
+    def __init__(self, broadcasts_col, users_col, worker_id, rate=25.0, workers=8, page_size=100, stale_after=60):
+        self.broadcasts_col = broadcasts_col
+        self.users_col = users_col
+        self.worker_id = worker_id
+        self.interval = 1.0 / rate
+        self.workers = workers
+        self.page_size = page_size
+        self.stale_after = stale_after
+        self.bot = None
+        self.job = None
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._pace_lock = asyncio.Lock()
+        self._running = False
+        self._task = None
+        self._watch_task = None
+
+    # --- CONTROL ---
+
+    async def start(self, bot, from_chat_id, message_id, admin_id, total):
+        """Begin a new broadcast; returns None when one is already running."""
+        now = datetime.datetime.now()
+        job = {
+            'from_chat_id': from_chat_id,
+            'message_id': message_id,
+            'admin_id': admin_id,
+            'status': 'running',
+            'owner': self.worker_id,
+            'heartbeat_at': now,
+            'created_at': now,
+            'last_user_id': None,
+            'total': total,
+            'sent': 0,
+            'failed': 0,
+            'blocked': 0,
+        }
+        try:
+            # A unique partial index allows a single running job across all workers
+            result = await self.broadcasts_col.insert_one(job)
+        except DuplicateKeyError:
+            return None
+        job['_id'] = result.inserted_id
+        self._launch(bot, job)
+        return job
+
+    async def resume(self, bot):
+        """Pick up an unfinished job now, then look again every `stale_after` seconds."""
+        self.bot = bot
+        await self._adopt()
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def _adopt(self):
+        # A job this worker owned, one released by a graceful stop, or one whose owner stopped checkpointing
+        if self._task is not None:
+            return
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=self.stale_after)
+        job = await self.broadcasts_col.find_one_and_update(
+            {'status': 'running', '$or': [
+                {'owner': self.worker_id}, {'owner': None}, {'heartbeat_at': {'$lt': cutoff}},
+            ]},
+            {'$set': {'owner': self.worker_id, 'heartbeat_at': datetime.datetime.now()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if job:
+            logger.info(f"Resuming broadcast {job['_id']} after user {job['last_user_id']}")
+            self._launch(self.bot, job)
+
+    async def _watch(self):
+        # A crashed owner never releases its job; it is adopted once its heartbeat is stale
+        while True:
+            await asyncio.sleep(self.stale_after)
+            try:
+                await self._adopt()
+            except Exception as e:
+                logger.error(f"Broadcast resume check failed: {e}")
+
+    async def cancel(self):
+        # Seen by the owning worker at its next checkpoint, wherever it runs
+        result = await self.broadcasts_col.update_many(
+            {'status': 'running'},
+            {'$set': {'status': 'cancelled', 'finished_at': datetime.datetime.now()}}
+        )
+        return result.modified_count
+
+    async def progress(self):
+        if self.job and self._running:
+            return self.job
+        return await self.broadcasts_col.find_one({}, sort=[('created_at', -1)])
+
+    def _launch(self, bot, job):
+        if self._task is not None:
+            return
+        self.bot = bot
+        self.job = job
+        self._running = True
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+        if self._task:
+            # In-flight sends finish and are checkpointed; the job stays 'running' for resume()
+            self._running = False
+            await self._task
+            self._task = None
+        if self.job and self.job['status'] == 'running':
+            # Released rather than left to go stale, so the next process resumes it at once
+            try:
+                await self.broadcasts_col.update_one(
+                    {'_id': self.job['_id'], 'status': 'running', 'owner': self.worker_id},
+                    {'$set': {'owner': None, 'heartbeat_at': None}}
+                )
+            except Exception as e:
+                logger.error(f"Could not release broadcast {self.job['_id']}: {e}")
+
+    # --- SENDING ---
+
+    async def _pace(self):
+        loop = asyncio.get_running_loop()
+        async with self._pace_lock:
+            now = loop.time()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _deliver(self, user_id):
+        attempts = 0
+        while True:
+            await self._pace()
+            try:
+                await self.bot.copy_message(
+                    chat_id=user_id, from_chat_id=self.job['from_chat_id'], message_id=self.job['message_id']
+                )
+                return 'sent'
+            except RetryAfter as e:
+                # Flood control applies to the whole bot, so every worker backs off
+                self._paused_until = asyncio.get_running_loop().time() + e.retry_after
+            except Forbidden:
+                # Blocked the bot or deleted their account
+                return 'blocked'
+            except BadRequest:
+                return 'failed'
+            except (TimedOut, NetworkError):
+                attempts += 1
+                if attempts >= 3:
+                    return 'failed'
+                await asyncio.sleep(2 ** attempts)
+            except Exception as e:
+                logger.error(f"Broadcast to {user_id} failed: {e}")
+                return 'failed'
+
+    async def _send_page(self, user_ids):
+        queue = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait(user_id)
+        blocked = []
+        last_taken = None
+
+        async def worker():
+            nonlocal last_taken
+            while self._running:
+                try:
+                    user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                # Taken in user_id order and always finished, so the largest taken id is a safe checkpoint
+                last_taken = user_id if last_taken is None else max(last_taken, user_id)
+                outcome = await self._deliver(user_id)
+                self.job[outcome] += 1
+                if outcome == 'blocked':
+                    blocked.append(user_id)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(user_ids)))))
+        if blocked:
+            await self.users_col.update_many({'user_id': {'$in': blocked}}, {'$set': {'blocked': True}})
+        return last_taken
+
+    async def _checkpoint(self, **fields):
+        job = self.job
+        result = await self.broadcasts_col.update_one(
+            {'_id': job['_id'], 'status': 'running', 'owner': self.worker_id},
+            {'$set': {
+                'last_user_id': job['last_user_id'], 'sent': job['sent'], 'failed': job['failed'],
+                'blocked': job['blocked'], 'heartbeat_at': datetime.datetime.now(), **fields,
+            }}
+        )
+        # Cancelled by an admin, or taken over by another worker
+        return result.matched_count == 1
+
+    async def _next_page(self):
+        query = {'is_banned': {'$ne': True}, 'blocked': {'$ne': True}}
+        if self.job['last_user_id'] is not None:
+            query['user_id'] = {'$gt': self.job['last_user_id']}
+        cursor = self.users_col.find(query, {'user_id': 1, '_id': 0}).sort('user_id', 1)
+        cursor = cursor.limit(self.page_size).batch_size(self.page_size)
+        return [doc['user_id'] async for doc in cursor]
+
+    async def _run(self):
+        job = self.job
+        try:
+            while self._running:
+                user_ids = await self._next_page()
+                if not user_ids:
+                    await self._checkpoint(status='done', finished_at=datetime.datetime.now())
+                    job['status'] = 'done'
+                    await self._report()
+                    return
+                last_taken = await self._send_page(user_ids)
+                if last_taken is not None:
+                    job['last_user_id'] = last_taken
+                if not await self._checkpoint():
+                    job['status'] = 'cancelled'
+                    logger.info(f"Broadcast {job['_id']} cancelled")
+                    return
+        except Exception as e:
+            logger.error(f"Broadcast {job['_id']} stopped: {e}")
+        finally:
+            self._running = False
+            self._task = None
+
+    async def _report(self):
+        job = self.job
+        logger.info(f"Broadcast {job['_id']} done: {job['sent']} sent, {job['blocked']} blocked, {job['failed']} failed")
+        try:
+            await self.bot.send_message(
+                chat_id=job['admin_id'],
+                text=(
+                    f"📣 Broadcast finished!\n\n"
+                    f"✅ Sent: {job['sent']}\n"
+                    f"🚫 Blocked: {job['blocked']}\n"
+                    f"⚠️ Failed: {job['failed']}"
+                )
+            )
+        except Exception as e:
+            logger.error(f"Could not report broadcast result: {e}")
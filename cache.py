@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire after a per-entry TTL.
+
+    Expired entries are dropped when read, unless `keep_stale` is set: then
+    they stay until replaced or evicted, so stale() can still serve them.
+    """
+
+    def __init__(self, maxsize, ttl, keep_stale=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.keep_stale = keep_stale
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        value, expires = entry
+        if expires < time.monotonic():
+            if not self.keep_stale:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        # Like get() but without touching LRU order or the hit/miss counters
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        if entry[1] < time.monotonic():
+            if not self.keep_stale:
+                del self._data[key]
+            return default
+        return entry[0]
+
+    def stale(self, key, default=None):
+        # Last known value even if expired, for when the source of truth is unreachable;
+        # only caches built with keep_stale=True hold on to expired entries
+        entry = self._data.get(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key, _MISSING)
+        return entry is not _MISSING and entry[1] >= time.monotonic()
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import telegram
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# process_update is @final in PTB and documented as not for overriding; the
+# override below was checked against this release only (see requirements.txt)
+VERIFIED_PTB_VERSION = (20, 8)
+if telegram.__version_info__[:2] != VERIFIED_PTB_VERSION:
+    logger.warning(
+        f"UserOrderedUpdateProcessor overrides BaseUpdateProcessor.process_update, verified on PTB "
+        f"{'.'.join(map(str, VERIFIED_PTB_VERSION))} only; running {telegram.__version__}"
+    )
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each user's updates in order.
+
+    Updates from the same user wait on a per-user lock *before* taking one of
+    the `max_concurrent_updates` slots, so a user spamming buttons queues behind
+    themselves instead of occupying the whole pool.
+
+    That ordering needs the lock outside PTB's semaphore, which is only
+    reachable by overriding `process_update`. do_process_update runs inside
+    the semaphore, so moving the lock there would let one user's backlog
+    hold every slot. Re-check this class when upgrading python-telegram-bot.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._locks = {}
+
+    @staticmethod
+    def update_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return ('chat', update.effective_chat.id)
+        return None
+
+    async def process_update(self, update, coroutine):  # @final upstream, see VERIFIED_PTB_VERSION
+        key = self.update_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
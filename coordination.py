@@ -0,0 +1,109 @@
+import asyncio
+import datetime
+import logging
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(user_id, shard_count):
+    # Must agree with router.shard_for, which routes the raw updates
+    return user_id % shard_count if shard_count > 1 else 0
+
+
+class Lease:
+    """A named lease in Mongo, so a singleton job runs in one process at a time.
+
+    The holder renews it by acquiring again; if it dies, another process can
+    take over once `ttl` seconds have passed since the last renewal.
+    """
+
+    def __init__(self, collection, name, owner, ttl):
+        self.collection = collection
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+
+    async def acquire(self):
+        now = datetime.datetime.now()
+        try:
+            doc = await self.collection.find_one_and_update(
+                {'_id': self.name, '$or': [{'owner': self.owner}, {'expires_at': {'$lt': now}}]},
+                {'$set': {'owner': self.owner, 'expires_at': now + datetime.timedelta(seconds=self.ttl)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Held by someone else: the filter missed and the upsert hit their document
+            return False
+        if doc is None or doc.get('owner') != self.owner:
+            logger.info(f"Lease {self.name} acquired by {self.owner}")
+        return True
+
+    async def release(self):
+        await self.collection.delete_one({'_id': self.name, 'owner': self.owner})
+
+
+class ShardInvalidations:
+    """Cross-shard cache invalidation through a small Mongo collection.
+
+    With updates sharded by user, each process caches only its own users,
+    except when it writes to someone else's document (crediting a referrer).
+    It then publishes the user id for the owning shard, which polls for its
+    events and drops the cached entry. Re-reading a short overlap each poll is
+    harmless, since dropping an entry twice changes nothing.
+    """
+
+    def __init__(self, collection, shard_index, shard_count, on_invalidate, poll_interval=1.0, overlap=5.0):
+        self.collection = collection
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.on_invalidate = on_invalidate
+        self.poll_interval = poll_interval
+        self.overlap = datetime.timedelta(seconds=overlap)
+        self._since = datetime.datetime.now()
+        self._task = None
+
+    @property
+    def enabled(self):
+        return self.shard_count > 1
+
+    def owns(self, user_id):
+        return shard_of(user_id, self.shard_count) == self.shard_index
+
+    async def publish(self, user_id):
+        if not self.enabled or self.owns(user_id):
+            return
+        await self.collection.insert_one({
+            'shard': shard_of(user_id, self.shard_count),
+            'user_id': user_id,
+            'at': datetime.datetime.now()
+        })
+
+    async def poll(self):
+        started = datetime.datetime.now()
+        async for doc in self.collection.find(
+            {'shard': self.shard_index, 'at': {'$gte': self._since - self.overlap}}, {'_id': 0, 'user_id': 1}
+        ):
+            self.on_invalidate(doc['user_id'])
+        self._since = started
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Cache invalidation poll failed: {e}")
+
+    def start(self):
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,141 @@
+import asyncio
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CouponPool:
+    """Small per-denomination queues of coupons reserved by this worker.
+
+    Coupons are claimed in batches by stamping `reserved_by` with the worker id,
+    so a redemption can mark its coupon used by `_id` instead of racing other
+    requests for the first unused document of that amount.
+    """
+
+    def __init__(self, coupons_col, denominations, worker_id, size=20, refill_interval=2.0, stale_after=600):
+        self.coupons_col = coupons_col
+        self.worker_id = worker_id
+        self.size = size
+        self.low_water = max(size // 2, 1)
+        self.refill_interval = refill_interval
+        self.stale_after = stale_after
+        self.queues = {amount: asyncio.Queue() for amount in denominations}
+        self._wake = asyncio.Event()
+        self._running = False
+        self._task = None
+
+    # --- HAND OUT ---
+
+    def take(self, amount):
+        queue = self.queues.get(amount)
+        if queue is None:
+            return None
+        try:
+            doc = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            doc = None
+        if queue.qsize() < self.low_water:
+            self._wake.set()
+        return doc
+
+    def give_back(self, amount, doc):
+        # The coupon is still reserved by us (e.g. its transaction rolled back)
+        self.queues[amount].put_nowait(doc)
+
+    # --- RESERVATION ---
+
+    async def refill(self, amount):
+        queue = self.queues[amount]
+        need = self.size - queue.qsize()
+        if need <= 0:
+            return 0
+
+        cursor = self.coupons_col.find(
+            {'amount': amount, 'is_used': False, 'reserved_by': None}, {'_id': 1}
+        ).limit(need)
+        ids = [doc['_id'] async for doc in cursor]
+        if not ids:
+            return 0
+
+        await self.coupons_col.update_many(
+            {'_id': {'$in': ids}, 'is_used': False, 'reserved_by': None},
+            {'$set': {'reserved_by': self.worker_id, 'reserved_at': datetime.datetime.now()}}
+        )
+        # Another worker may have won some of them between the two calls
+        added = 0
+        async for doc in self.coupons_col.find(
+            {'_id': {'$in': ids}, 'reserved_by': self.worker_id, 'is_used': False}, {'code': 1}
+        ):
+            queue.put_nowait(doc)
+            added += 1
+        return added
+
+    async def reclaim_stale(self, own=True):
+        # At startup our own leftovers go too; later only other workers' stale reservations do
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=self.stale_after)
+        stale = {'reserved_by': {'$nin': [None, self.worker_id]}, 'reserved_at': {'$lt': cutoff}}
+        result = await self.coupons_col.update_many(
+            {'is_used': False, '$or': [{'reserved_by': self.worker_id}, stale] if own else [stale]},
+            {'$set': {'reserved_by': None, 'reserved_at': None}}
+        )
+        if result.modified_count:
+            logger.info(f"Reclaimed {result.modified_count} stale coupon reservation(s)")
+
+    async def release(self):
+        result = await self.coupons_col.update_many(
+            {'reserved_by': self.worker_id, 'is_used': False},
+            {'$set': {'reserved_by': None, 'reserved_at': None}}
+        )
+        for queue in self.queues.values():
+            while not queue.empty():
+                queue.get_nowait()
+        logger.info(f"Released {result.modified_count} coupon reservation(s)")
+
+    async def _heartbeat(self):
+        # Keeps live reservations from looking stale to other workers
+        await self.coupons_col.update_many(
+            {'reserved_by': self.worker_id, 'is_used': False},
+            {'$set': {'reserved_at': datetime.datetime.now()}}
+        )
+
+    # --- BACKGROUND REFILL ---
+
+    async def _refill_loop(self):
+        last_heartbeat = asyncio.get_running_loop().time()
+        while self._running:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self._running:
+                break
+            try:
+                for amount in self.queues:
+                    await self.refill(amount)
+                now = asyncio.get_running_loop().time()
+                if now - last_heartbeat > self.stale_after / 3:
+                    await self._heartbeat()
+                    # Reservations of a crashed worker (new pid, new id) return to the shared stock
+                    await self.reclaim_stale(own=False)
+                    last_heartbeat = now
+            except Exception as e:
+                logger.error(f"Coupon pool refill failed: {e}")
+
+    async def start(self):
+        await self.reclaim_stale()
+        for amount in self.queues:
+            await self.refill(amount)
+        if self._task is None:
+            self._running = True
+            self._task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        if self._task:
+            # Woken rather than cancelled, so an in-flight refill finishes before release
+            self._running = False
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.release()
@@ -0,0 +1,171 @@
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+
+# Bot API uploads are capped at 50 MB, parts are cut a little below that
+MAX_PART_BYTES = 45 * 1024 * 1024
+
+EXPORTS = {
+    'users': {
+        'date_field': 'created_at',
+        'fields': ['user_id', 'username', 'first_name', 'last_name', 'balance', 'referral_count',
+                   'redeemed_count', 'referred_by', 'is_banned', 'blocked', 'created_at', 'last_active'],
+    },
+    'coupons': {
+        'date_field': 'added_at',
+        'fields': ['code', 'amount', 'is_used', 'used_by', 'used_at', 'added_at'],
+    },
+    'redeemed': {
+        'date_field': 'redeemed_at',
+        'fields': ['user_id', 'code', 'amount', 'redeemed_at'],
+    },
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def build_query(collection, since=None, until=None, used=None, amount=None):
+    """Mongo filter for an export; `until` is exclusive."""
+    spec = EXPORTS[collection]
+    query = {}
+    if used is not None:
+        if collection != 'coupons':
+            raise ExportError("used/unused only applies to coupons")
+        query['is_used'] = used
+    if amount is not None:
+        if collection == 'users':
+            raise ExportError("amount does not apply to users")
+        query['amount'] = amount
+    if since or until:
+        # A used-coupon export is about when they went out, not when they were added
+        date_field = 'used_at' if collection == 'coupons' and used else spec['date_field']
+        query[date_field] = {}
+        if since:
+            query[date_field]['$gte'] = since
+        if until:
+            query[date_field]['$lt'] = until
+    return query
+
+
+def parse_args(args):
+    """/export <users|coupons|redeemed> [csv|jsonl] [from=YYYY-MM-DD] [to=YYYY-MM-DD] [used|unused] [amount=N]"""
+    if not args or args[0].lower() not in EXPORTS:
+        raise ExportError(f"choose one of: {', '.join(EXPORTS)}")
+    collection, fmt = args[0].lower(), 'csv'
+    filters = {}
+    for arg in args[1:]:
+        key, _, value = arg.lower().partition('=')
+        try:
+            if key in ('csv', 'jsonl') and not value:
+                fmt = key
+            elif key in ('used', 'unused') and not value:
+                filters['used'] = key == 'used'
+            elif key == 'from':
+                filters['since'] = datetime.datetime.strptime(value, '%Y-%m-%d')
+            elif key == 'to':
+                # Inclusive for the admin: the whole "to" day is exported
+                filters['until'] = datetime.datetime.strptime(value, '%Y-%m-%d') + datetime.timedelta(days=1)
+            elif key == 'amount':
+                filters['amount'] = int(value)
+            else:
+                raise ExportError(f"unknown option '{arg}'")
+        except ValueError as e:
+            if isinstance(e, ExportError):
+                raise
+            raise ExportError(f"bad value in '{arg}'")
+    return collection, fmt, build_query(collection, **filters)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    return value
+
+
+class _PartWriter:
+    """Gzip output that rolls over to a new file before a part outgrows MAX_PART_BYTES."""
+
+    def __init__(self, out_dir, basename, fmt, fields, part_bytes):
+        self.out_dir = out_dir
+        self.basename = basename
+        self.fmt = fmt
+        self.fields = fields
+        self.part_bytes = part_bytes
+        self.paths = []
+        self._raw = None
+        self._gz = None
+
+    def _open(self):
+        path = os.path.join(self.out_dir, f"{self.basename}-part{len(self.paths) + 1}.{self.fmt}.gz")
+        self.paths.append(path)
+        self._raw = open(path, 'wb')
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6)
+        if self.fmt == 'csv':
+            self._gz.write((','.join(self.fields) + '\r\n').encode('utf-8'))
+
+    def write(self, docs):
+        # Runs in a worker thread; encoding and compression never block the event loop
+        if self._gz is None or self._raw.tell() >= self.part_bytes:
+            self.close()
+            self._open()
+        self._gz.write(_encode(docs, self.fmt, self.fields))
+
+    def close(self):
+        if self._gz is not None:
+            self._gz.close()
+            self._raw.close()
+            self._gz = self._raw = None
+
+
+def _encode(docs, fmt, fields):
+    if fmt == 'jsonl':
+        return ''.join(json.dumps({f: doc.get(f) for f in fields}, default=str, ensure_ascii=False) + '\n'
+                       for doc in docs).encode('utf-8')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for doc in docs:
+        writer.writerow([_csv_value(doc.get(f)) for f in fields])
+    return buffer.getvalue().encode('utf-8')
+
+
+async def export_collection(db, collection, fmt, query, out_dir, batch_size=1000,
+                            part_bytes=MAX_PART_BYTES, progress=None, sources=None):
+    """Stream matching documents into gzip files under out_dir.
+
+    Documents are fetched `batch_size` at a time and each batch is encoded and
+    compressed before the next one is read, so memory stays flat however large
+    the collection. `sources` lists the collections to read (the hot one and
+    its archives), defaulting to `collection` alone. Returns (paths, row_count).
+    """
+    fields = EXPORTS[collection]['fields']
+    basename = f"{collection}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    output = _PartWriter(out_dir, basename, fmt, fields, part_bytes)
+    projection = {field: 1 for field in fields}
+    projection['_id'] = 0
+
+    rows = 0
+    batch = []
+    try:
+        for source in sources or [collection]:
+            async for doc in db[source].find(query, projection).batch_size(batch_size):
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    await asyncio.to_thread(output.write, batch)
+                    rows += len(batch)
+                    batch = []
+                    if progress:
+                        await progress(rows)
+        if batch or not output.paths:
+            await asyncio.to_thread(output.write, batch)
+            rows += len(batch)
+    finally:
+        await asyncio.to_thread(output.close)
+    return output.paths, rows
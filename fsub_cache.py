@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import time
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+JOINED_STATUSES = ('member', 'administrator', 'creator')
+
+
+class MembershipCache:
+    """Force-subscribe checks with a bounded positive/negative cache.
+
+    Entries are evicted as soon as a chat_member update reports that the
+    user joined or left one of the channels.
+    """
+
+    def __init__(self, channel_ids, maxsize=100_000, positive_ttl=60, negative_ttl=5, invite_ttl=3600):
+        self.channel_ids = list(channel_ids)
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.invite_ttl = invite_ttl
+        self.members = TTLCache(maxsize, positive_ttl)
+        self._invite_links = {}
+
+    async def _check_channel(self, bot, channel_id, user_id):
+        try:
+            member = await bot.get_chat_member(channel_id, user_id)
+            return member.status in JOINED_STATUSES
+        except Exception as e:
+            logger.error(f"Error checking channel {channel_id}: {e}")
+            return False
+
+    async def is_member(self, user_id, bot, use_cache=True):
+        if not self.channel_ids:
+            return True
+        if use_cache:
+            cached = self.members.get(user_id)
+            if cached is not None:
+                return cached
+
+        results = await asyncio.gather(*(self._check_channel(bot, ch, user_id) for ch in self.channel_ids))
+        joined = all(results)
+        self.members.set(user_id, joined, self.positive_ttl if joined else self.negative_ttl)
+        return joined
+
+    def invalidate(self, user_id):
+        self.members.pop(user_id)
+
+    def on_chat_member(self, chat_member):
+        if chat_member.chat.id not in self.channel_ids:
+            return
+        old, new = chat_member.old_chat_member, chat_member.new_chat_member
+        if (old.status in JOINED_STATUSES) != (new.status in JOINED_STATUSES):
+            self.invalidate(new.user.id)
+
+    # --- INVITE LINKS ---
+
+    async def _invite_link(self, bot, channel_id):
+        cached = self._invite_links.get(channel_id)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        try:
+            chat = await bot.get_chat(channel_id)
+            link = chat.invite_link or f"https://t.me/c/{str(channel_id)[4:]}/1"
+            self._invite_links[channel_id] = (link, time.monotonic() + self.invite_ttl)
+        except Exception as e:
+            logger.error(f"Could not fetch invite link for {channel_id}: {e}")
+            # Keep serving the last known link rather than a dead button
+            link = cached[0] if cached else "#"
+        return link
+
+    async def invite_links(self, bot):
+        return await asyncio.gather(*(self._invite_link(bot, ch) for ch in self.channel_ids))
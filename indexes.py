@@ -0,0 +1,125 @@
+import datetime
+import logging
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+logger = logging.getLogger(__name__)
+
+# --- REQUIRED INDEXES ---
+# Every hot query in main.py must be covered by one of these.
+REQUIRED_INDEXES = {
+    'users': [
+        IndexModel([('user_id', ASCENDING)], unique=True),
+        IndexModel([('last_active', DESCENDING)]),
+        IndexModel([('referral_count', DESCENDING), ('user_id', ASCENDING)]),
+    ],
+    'coupons': [
+        IndexModel([('code', ASCENDING)], unique=True),
+        IndexModel([('amount', ASCENDING), ('is_used', ASCENDING), ('reserved_by', ASCENDING)]),
+        IndexModel([('reserved_by', ASCENDING)]),
+        # Archive scan; partial, so unused stock adds nothing to it
+        IndexModel([('used_at', ASCENDING)], partialFilterExpression={'is_used': True}),
+    ],
+    'redeemed': [
+        IndexModel([('user_id', ASCENDING), ('redeemed_at', DESCENDING)]),
+        IndexModel([('redeemed_at', ASCENDING)]),
+    ],
+    'broadcasts': [
+        # At most one running broadcast; BroadcastEngine.start relies on the E11000
+        IndexModel([('status', ASCENDING)], unique=True, partialFilterExpression={'status': 'running'}),
+    ],
+    'persistence': [
+        IndexModel([('kind', ASCENDING), ('name', ASCENDING)]),
+    ],
+    'cache_events': [
+        IndexModel([('shard', ASCENDING), ('at', ASCENDING)]),
+        # Polled every second; by 10 minutes the profile it targets has left the cache (default USER_CACHE_TTL)
+        IndexModel([('at', ASCENDING)], expireAfterSeconds=600),
+    ],
+    'referral_weekly': [
+        IndexModel([('week', ASCENDING), ('user_id', ASCENDING)], unique=True),
+        IndexModel([('week', ASCENDING), ('count', DESCENDING), ('user_id', ASCENDING)]),
+    ],
+}
+
+# --- HOT QUERIES (explained by the self-check) ---
+HOT_QUERIES = [
+    ('get_user', {'find': 'users', 'filter': {'user_id': 0}, 'limit': 1}),
+    ('active_today', {'count': 'users', 'query': {'last_active': {'$gte': datetime.datetime(2000, 1, 1)}}}),
+    ('coupon_by_code', {'find': 'coupons', 'filter': {'code': ''}, 'limit': 1}),
+    ('claim_coupon', {
+        'findAndModify': 'coupons',
+        'query': {'amount': 0, 'is_used': False, 'reserved_by': None},
+        'update': {'$set': {'is_used': True}},
+    }),
+    ('claim_reserved_coupon', {
+        'findAndModify': 'coupons',
+        'query': {'amount': 0, 'is_used': False},
+        'update': {'$set': {'is_used': True}},
+    }),
+    ('pool_refill', {'find': 'coupons', 'filter': {'amount': 0, 'is_used': False, 'reserved_by': None}, 'limit': 20}),
+    ('pool_release', {'count': 'coupons', 'query': {'reserved_by': 'worker', 'is_used': False}}),
+    ('redeemed_count', {'count': 'redeemed', 'query': {'user_id': 0}}),
+    ('broadcast_page', {'find': 'users', 'filter': {'user_id': {'$gt': 0}, 'is_banned': {'$ne': True}, 'blocked': {'$ne': True}},
+                        'sort': {'user_id': 1}, 'limit': 100}),
+    ('leaderboard_top', {'find': 'users', 'filter': {'referral_count': {'$gt': 0}},
+                         'sort': {'referral_count': -1, 'user_id': 1}, 'limit': 10}),
+    ('referral_rank', {'count': 'users', 'query': {'referral_count': {'$gt': 0}}}),
+    ('weekly_top', {'find': 'referral_weekly', 'filter': {'week': ''}, 'sort': {'count': -1, 'user_id': 1}, 'limit': 10}),
+    ('weekly_rank', {'count': 'referral_weekly', 'query': {'week': '', 'count': {'$gt': 0}}}),
+    ('archive_coupons', {'find': 'coupons', 'filter': {'is_used': True, 'used_at': {'$lt': datetime.datetime(2000, 1, 1)}},
+                         'sort': {'used_at': 1}, 'limit': 1000}),
+    ('archive_redeemed', {'find': 'redeemed', 'filter': {'redeemed_at': {'$lt': datetime.datetime(2000, 1, 1)}},
+                          'sort': {'redeemed_at': 1}, 'limit': 1000}),
+    ('cache_events', {'find': 'cache_events', 'filter': {'shard': 0, 'at': {'$gte': datetime.datetime(2000, 1, 1)}}}),
+    ('last_redemption', {'find': 'redeemed', 'filter': {'user_id': 0}, 'sort': {'redeemed_at': -1}, 'limit': 1}),
+]
+
+
+async def ensure_indexes(db):
+    """Create the required indexes; raise if a unique one cannot be built.
+
+    Unique indexes are what duplicate detection relies on (bulk coupon
+    imports count E11000 errors), so running without one would hand out
+    duplicate codes. The others only cost speed and stay best-effort.
+    """
+    for name, models in REQUIRED_INDEXES.items():
+        unique = [model for model in models if model.document.get('unique')]
+        if unique:
+            try:
+                created = await db[name].create_indexes(unique)
+                logger.info(f"Unique indexes ready on {name}: {', '.join(created)}")
+            except Exception as e:
+                # Usually pre-existing duplicate data
+                raise RuntimeError(f"Could not create unique indexes on {name}, remove the duplicates first: {e}") from e
+        other = [model for model in models if not model.document.get('unique')]
+        if other:
+            try:
+                created = await db[name].create_indexes(other)
+                logger.info(f"Indexes ready on {name}: {', '.join(created)}")
+            except Exception as e:
+                logger.error(f"Could not create indexes on {name}: {e}")
+
+
+def _plan_stages(node):
+    if isinstance(node, dict):
+        if 'stage' in node:
+            yield node['stage']
+        for value in node.values():
+            yield from _plan_stages(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _plan_stages(item)
+
+
+async def verify_query_plans(db):
+    """Explain every hot query and raise if any of them falls back to a COLLSCAN."""
+    failures = []
+    for label, command in HOT_QUERIES:
+        explain = await db.command('explain', command, verbosity='queryPlanner')
+        stages = list(_plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {})))
+        if 'COLLSCAN' in stages:
+            failures.append(label)
+        logger.info(f"Query plan [{label}]: {' <- '.join(stages) or 'n/a'}")
+
+    if failures:
+        raise RuntimeError(f"Hot queries fall back to COLLSCAN: {', '.join(failures)}")
@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+import logging
+from pymongo import ASCENDING, DESCENDING
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def week_key(day=None):
+    year, week, _ = (day or datetime.date.today()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+class Leaderboard:
+    """Referral rankings served from memory.
+
+    The all-time board reads the top of the `referral_count` index and the
+    weekly board reads per-week counters bumped on every referral. Both
+    snapshots are refreshed in the background. A user's rank is one indexed
+    count of the users ahead of them, cached for `rank_ttl` seconds.
+    """
+
+    def __init__(self, users_col, weekly_col, top_n=10, refresh_interval=60, rank_ttl=30, cache_size=50_000):
+        self.users_col = users_col
+        self.weekly_col = weekly_col
+        self.top_n = top_n
+        self.refresh_interval = refresh_interval
+        self.ranks = TTLCache(cache_size, rank_ttl)
+        self.boards = {'all': [], 'week': []}
+        self.refreshed_at = None
+        self._week = None
+        self._task = None
+
+    # --- INCREMENTAL EVENTS ---
+
+    async def on_referral(self, referrer_id):
+        await self.weekly_col.update_one(
+            {'week': week_key(), 'user_id': referrer_id},
+            {'$inc': {'count': 1}},
+            upsert=True
+        )
+
+    # --- SNAPSHOTS ---
+
+    async def _top_all_time(self):
+        cursor = self.users_col.find(
+            {'referral_count': {'$gt': 0}}, {'_id': 0, 'user_id': 1, 'first_name': 1, 'referral_count': 1}
+        ).sort([('referral_count', DESCENDING), ('user_id', ASCENDING)]).limit(self.top_n)
+        return [(doc['user_id'], doc.get('first_name'), doc['referral_count']) async for doc in cursor]
+
+    async def _top_week(self, week):
+        cursor = self.weekly_col.find(
+            {'week': week}, {'_id': 0, 'user_id': 1, 'count': 1}
+        ).sort([('count', DESCENDING), ('user_id', ASCENDING)]).limit(self.top_n)
+        rows = [(doc['user_id'], doc['count']) async for doc in cursor]
+        names = {}
+        if rows:
+            async for doc in self.users_col.find({'user_id': {'$in': [uid for uid, _ in rows]}}, {'user_id': 1, 'first_name': 1}):
+                names[doc['user_id']] = doc.get('first_name')
+        return [(uid, names.get(uid), count) for uid, count in rows]
+
+    async def refresh(self):
+        week = week_key()
+        top_all, top_week = await asyncio.gather(self._top_all_time(), self._top_week(week))
+        self.boards = {'all': top_all, 'week': top_week}
+        if week != self._week:
+            # A new week starts everyone at zero
+            self.ranks.clear()
+            self._week = week
+        self.refreshed_at = datetime.datetime.now()
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Leaderboard refresh failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # --- READ ---
+
+    async def top(self, board='all'):
+        if self.refreshed_at is None or week_key() != self._week:
+            await self.refresh()
+        return self.boards[board]
+
+    async def rank(self, user_id, board='all', referral_count=None):
+        """Return (rank, count) of a user on a board; rank is None with no referrals yet."""
+        key = (board, user_id)
+        cached = self.ranks.get(key)
+        if cached is not None:
+            return cached
+
+        if board == 'week':
+            doc = await self.weekly_col.find_one({'week': week_key(), 'user_id': user_id}, {'count': 1})
+            count = doc['count'] if doc else 0
+            ahead = await self.weekly_col.count_documents({'week': week_key(), 'count': {'$gt': count}}) if count else None
+        else:
+            count = referral_count or 0
+            ahead = await self.users_col.count_documents({'referral_count': {'$gt': count}}) if count else None
+
+        result = (ahead + 1 if ahead is not None else None, count)
+        self.ranks.set(key, result)
+        return result
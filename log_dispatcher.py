@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from telegram.error import RetryAfter, TimedOut, NetworkError
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+SEPARATOR = "\n\n➖➖➖➖➖\n\n"
+_STOP = object()
+
+
+class LogDispatcher:
+    """Queues log-channel lines and delivers them from a single background consumer.
+
+    Queued lines are coalesced into messages of up to 4096 characters and sent
+    no faster than one message per `min_interval` seconds.
+    """
+
+    def __init__(self, chat_id, min_interval=3.0, maxsize=10000, flush_timeout=15.0):
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self.flush_timeout = flush_timeout
+        self.queue = asyncio.Queue(maxsize)
+        self.bot = None
+        self.sent = 0
+        self.dropped = 0
+        self._carry = None
+        self._closing = False
+        self._task = None
+
+    def enqueue(self, text):
+        if not self.chat_id:
+            return
+        # Oversized entries are split so each piece fits in one message
+        for start in range(0, len(text), MAX_MESSAGE_LENGTH):
+            try:
+                self.queue.put_nowait(text[start:start + MAX_MESSAGE_LENGTH])
+            except asyncio.QueueFull:
+                self.dropped += 1
+                logger.warning("Log queue full, dropping a log line")
+
+    async def _collect(self):
+        parts, size = [], 0
+        if self._carry is None and not self._closing:
+            item = await self.queue.get()
+            if item is _STOP:
+                self._closing = True
+            else:
+                self._carry = item
+
+        while True:
+            if self._carry is not None:
+                item, self._carry = self._carry, None
+            else:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is _STOP:
+                    self._closing = True
+                    continue
+            extra = len(item) + (len(SEPARATOR) if parts else 0)
+            if parts and size + extra > MAX_MESSAGE_LENGTH:
+                self._carry = item
+                break
+            parts.append(item)
+            size += extra
+        return SEPARATOR.join(parts)
+
+    async def _send(self, text):
+        attempts = 0
+        while True:
+            try:
+                await self.bot.send_message(chat_id=self.chat_id, text=text)
+                self.sent += 1
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except (TimedOut, NetworkError) as e:
+                attempts += 1
+                if attempts >= 3:
+                    logger.error(f"Failed to log: {e}")
+                    return
+                await asyncio.sleep(2 ** attempts)
+            except Exception as e:
+                logger.error(f"Failed to log: {e}")
+                return
+
+    async def _run(self):
+        while True:
+            text = await self._collect()
+            if text:
+                await self._send(text)
+            if self._closing and self._carry is None and self.queue.empty():
+                return
+            if not self._closing:
+                await asyncio.sleep(self.min_interval)
+
+    def start(self, bot):
+        self.bot = bot
+        if self.chat_id and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        # Flush whatever is still queued, but never hold shutdown hostage
+        await self.queue.put(_STOP)
+        try:
+            await asyncio.wait_for(self._task, timeout=self.flush_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Log flush timed out, {self.queue.qsize()} line(s) not delivered")
+        self._task = None
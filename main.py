@@ -1,14 +1,45 @@
 import os
+import sys
+import asyncio
+import argparse
+import html
+import csv
 import logging
 import datetime
-import threading
+import itertools
+import tempfile
+import signal
 import time
+import socket
+import secrets
 from dotenv import load_dotenv
-from flask import Flask
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
-from telegram.constants import ParseMode
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup, ChatMember
+from telegram.constants import ParseMode, ChatType
+from telegram.error import NetworkError
+from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, ChatMemberHandler, TypeHandler
 import motor.motor_asyncio
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from stats import StatsEngine
+from indexes import ensure_indexes, verify_query_plans
+from redemption import RedemptionEngine, backfill_redemption_summaries
+from coupon_pool import CouponPool
+from fsub_cache import MembershipCache
+from log_dispatcher import LogDispatcher
+from webserver import build_web_app, start_web_server
+from concurrency import UserOrderedUpdateProcessor
+from user_cache import UserCache
+from broadcast import BroadcastEngine
+from leaderboard import Leaderboard
+from stock_watcher import StockWatcher
+from activity import ActivityTracker
+from persistence import MongoPersistence
+from throttle import FloodControl
+from resilience import CircuitBreaker, GuardedCollection, GuardedRequest, UNAVAILABLE_ERRORS, register_breakers
+from archive import Archiver
+from coordination import Lease, ShardInvalidations
+from router import UpdateRouter, WorkerSupervisor, build_router_app
+from exporter import ExportError, parse_args as parse_export_args, export_collection
+from metrics import REGISTRY, instrumented, MongoCommandListener
 
 # --- CONFIGURATION ---
 load_dotenv()
@@ -19,17 +50,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# --- FLASK SERVER (For 24/7 Uptime) ---
-app = Flask(__name__)
-
-@app.route('/')
-def health_check():
-    return "Bot is alive! 💎 High Speed Mode ON", 200
-
-def run_flask():
-    port = int(os.environ.get("PORT", 8080))
-    app.run(host="0.0.0.0", port=port)
-
 # --- BOT CONFIG ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 MONGO_URI = os.getenv("MONGO_URI")
@@ -41,36 +61,179 @@ except ValueError:
     ADMIN_IDS = []
     FSUB_CHANNEL_IDS = []
 
+# --- 🌐 SERVER CONFIG ---
+# polling: long-poll Telegram | webhook: Telegram POSTs updates to WEBHOOK_URL + WEBHOOK_PATH
+# router: receives the webhook and spreads updates over SHARD_COUNT worker processes by user id
+# worker: one shard, fed by the router (started by it, not by hand)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+PORT = int(os.getenv("PORT", "8080"))
+# Scale-out: number of worker processes, this worker's shard, ports the workers listen on
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", str(PORT + 1)))
+ROUTED_PATH = "/routed"
+# Shared by the router and its workers; set by the router, never by hand
+ROUTED_SECRET = os.getenv("ROUTED_SECRET", "")
+# Updates processed at once; one user's updates still run in order (1 = sequential)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+
 # --- 💎 WITHDRAWAL CONFIG 💎 ---
 COUPON_COSTS = {500: 1, 1000: 5, 2000: 25, 4000: 35}
 
+# Stats counters are reconciled against the database this often (seconds)
+STATS_RECONCILE_INTERVAL = int(os.getenv("STATS_RECONCILE_INTERVAL", "300"))
+
+# Coupons are written in chunks of this many codes during bulk imports
+COUPON_IMPORT_CHUNK = int(os.getenv("COUPON_IMPORT_CHUNK", "1000"))
+
+# Explain the hot queries at startup and refuse to run on a COLLSCAN
+INDEX_SELF_CHECK = os.getenv("INDEX_SELF_CHECK", "0") == "1"
+
+# Redemption atomicity: auto | transaction | compensate
+REDEMPTION_MODE = os.getenv("REDEMPTION_MODE", "auto")
+
+# Coupons pre-reserved per denomination by this process (0 disables the pool)
+COUPON_POOL_SIZE = int(os.getenv("COUPON_POOL_SIZE", "20"))
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+# Minimum seconds between two log-channel messages (channels allow ~20/min)
+LOG_CHANNEL_INTERVAL = float(os.getenv("LOG_CHANNEL_INTERVAL", "3"))
+
+# Cached user profiles (balance, counters) kept in memory
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))
+
+# Broadcast pacing: Telegram allows ~30 messages/s per bot across all chats
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+
+# Live stock: alert the log channel when a denomination drops to this many coupons
+STOCK_LOW_WATERMARK = int(os.getenv("STOCK_LOW_WATERMARK", "20"))
+# Recount interval when the coupons change stream is unavailable (no replica set)
+STOCK_POLL_INTERVAL = int(os.getenv("STOCK_POLL_INTERVAL", "15"))
+
+# Seconds between write-behind flushes of last_active and the DAU/WAU rollups
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "5"))
+
+# Leaderboard: users shown, seconds between snapshot refreshes
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+LEADERBOARD_REFRESH = int(os.getenv("LEADERBOARD_REFRESH", "60"))
+
+# Seconds between write-behind flushes of user_data and conversation states
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+
+# Documents fetched per round trip when streaming an admin export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Per-user flood control: tokens refilled per second and burst size (rate 0 = off)
+# "menu" covers menu taps and buttons, "action" covers redemptions and /start with a referral
+THROTTLE_MENU_RATE = float(os.getenv("THROTTLE_MENU_RATE", "1"))
+THROTTLE_MENU_BURST = int(os.getenv("THROTTLE_MENU_BURST", "8"))
+THROTTLE_ACTION_RATE = float(os.getenv("THROTTLE_ACTION_RATE", "0.2"))
+THROTTLE_ACTION_BURST = int(os.getenv("THROTTLE_ACTION_BURST", "3"))
+
+# Used coupons and redemptions older than this many days move to monthly archives;
+# the archive job runs every ARCHIVE_INTERVAL seconds (0 = only with --archive)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+# Outage handling: Mongo server selection and read timeouts, Bot API timeout,
+# consecutive failures that open a circuit and seconds before it is probed again
+MONGO_SELECT_TIMEOUT_MS = int(os.getenv("MONGO_SELECT_TIMEOUT_MS", "3000"))
+MONGO_READ_TIMEOUT = float(os.getenv("MONGO_READ_TIMEOUT", "2"))
+BOT_API_TIMEOUT = float(os.getenv("BOT_API_TIMEOUT", "5"))
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_RESET = int(os.getenv("BREAKER_RESET", "30"))
+
 # States for Admin Conversation
 WAITING_FOR_COUPONS = 1
 
 # --- DATABASE CONNECTION ---
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
-db = client['shein_bot_db']
-users_col = db['users']
-coupons_col = db['coupons']
-redeemed_col = db['redeemed']
+client = motor.motor_asyncio.AsyncIOMotorClient(
+    MONGO_URI, serverSelectionTimeoutMS=MONGO_SELECT_TIMEOUT_MS, event_listeners=[MongoCommandListener()]
+)
+db = client[os.getenv("MONGO_DB_NAME", "shein_bot_db")]
+
+# --- 🛡 CIRCUIT BREAKERS ---
+breakers = {
+    name: CircuitBreaker(name, failure_threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET)
+    for name in ('mongo:users', 'mongo:coupons', 'mongo:redeemed')
+}
+breakers['telegram'] = CircuitBreaker('telegram', (NetworkError,), BREAKER_THRESHOLD, BREAKER_RESET)
+register_breakers(breakers.values())
+
+users_col = GuardedCollection(db['users'], breakers['mongo:users'], MONGO_READ_TIMEOUT)
+coupons_col = GuardedCollection(db['coupons'], breakers['mongo:coupons'], MONGO_READ_TIMEOUT)
+redeemed_col = GuardedCollection(db['redeemed'], breakers['mongo:redeemed'], MONGO_READ_TIMEOUT)
 admin_logs_col = db['admin_logs']
+broadcasts_col = db['broadcasts']
+referral_weekly_col = db['referral_weekly']
+activity_rollups_col = db['activity_rollups']
+
+# --- 🗄 ARCHIVE ---
+# Leased, so only one worker archives at a time
+archive_lease = Lease(db['leases'], 'archive', WORKER_ID, max(ARCHIVE_INTERVAL * 2, 600))
+archiver = Archiver(db, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL, archive_lease)
+
+# --- 📊 LIVE STATS ENGINE ---
+stats_engine = StatsEngine(users_col, coupons_col, COUPON_COSTS.keys(), STATS_RECONCILE_INTERVAL, archiver)
+
+# --- 🎟 REDEMPTION ENGINE ---
+# Unguarded on purpose: a fast-failed refund would lose a user's balance mid-redemption,
+# so the redeem handler checks the breakers before it starts instead
+coupon_pool = CouponPool(coupons_col.unguarded, COUPON_COSTS.keys(), WORKER_ID, COUPON_POOL_SIZE) if COUPON_POOL_SIZE > 0 else None
+redemption_engine = RedemptionEngine(client, users_col.unguarded, coupons_col.unguarded, redeemed_col.unguarded,
+                                     REDEMPTION_MODE, coupon_pool)
 
 # --- 🚀 SPEED CACHE SYSTEM ---
-user_fsub_cache = {}
-CACHE_DURATION = 60 
+user_cache = UserCache(users_col, USER_CACHE_SIZE, USER_CACHE_TTL)
+# Sharded: a referrer's profile is cached by the worker owning them, told to drop it through Mongo
+shard_invalidations = ShardInvalidations(db['cache_events'], SHARD_INDEX, SHARD_COUNT, user_cache.invalidate)
+CACHE_DURATION = int(os.getenv("CACHE_DURATION", "60"))
+FSUB_NEGATIVE_TTL = int(os.getenv("FSUB_NEGATIVE_TTL", "5"))
+FSUB_CACHE_SIZE = int(os.getenv("FSUB_CACHE_SIZE", "100000"))
+user_fsub_cache = MembershipCache(FSUB_CHANNEL_IDS, FSUB_CACHE_SIZE, CACHE_DURATION, FSUB_NEGATIVE_TTL)
+
+# --- 🚦 FLOOD CONTROL ---
+# Admins are exempt: coupon uploads arrive as message bursts
+flood_control = FloodControl(THROTTLE_MENU_RATE, THROTTLE_MENU_BURST, THROTTLE_ACTION_RATE, THROTTLE_ACTION_BURST,
+                             exempt_ids=ADMIN_IDS)
+
+# --- 🟢 ACTIVITY TRACKER ---
+activity_tracker = ActivityTracker(users_col, activity_rollups_col, ACTIVITY_FLUSH_INTERVAL)
+
+# --- 📦 LIVE STOCK ---
+def alert_low_stock(amount, count):
+    if LOG_CHANNEL_ID:
+        log_to_channel(
+            f"⚠️ Low Stock Alert\n\n"
+            f"💰 Amount: {amount} 🎟 \n"
+            f"📦 Left: {count}\n"
+            f"🕒 Time: {datetime.datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}"
+        )
+
+stock_watcher = StockWatcher(coupons_col, COUPON_COSTS.keys(), STOCK_LOW_WATERMARK, STOCK_POLL_INTERVAL,
+                             on_low=alert_low_stock, alerts_col=db['stock_alerts'])
+
+# --- 🏆 LEADERBOARD ---
+leaderboard = Leaderboard(users_col, referral_weekly_col, LEADERBOARD_SIZE, LEADERBOARD_REFRESH)
+
+# --- 📣 BROADCAST ENGINE ---
+broadcast_engine = BroadcastEngine(broadcasts_col, users_col, WORKER_ID, BROADCAST_RATE, BROADCAST_WORKERS)
 
 # --- DATABASE FUNCTIONS ---
 
 async def get_user(user_id):
-    return await users_col.find_one({'user_id': user_id})
+    # Read-through profile cache; balance changes are written through below
+    return await user_cache.get(user_id)
 
 async def add_user(user, referrer_id=None):
-    existing = await get_user(user.id)
-    if existing:
-        return False
-    
+    # Single round trip: the upsert only writes when the user doesn't exist yet
     new_user = {
-        'user_id': user.id,
         'username': user.username,
         'first_name': user.first_name,
         'last_name': user.last_name,
@@ -80,12 +243,23 @@ async def add_user(user, referrer_id=None):
         'created_at': datetime.datetime.now(),
         'last_active': datetime.datetime.now(),
         'is_banned': False,
+        'redeemed_count': 0,
+        'recent_redemptions': [],
         'referred_by': referrer_id
     }
-    await users_col.insert_one(new_user)
+    try:
+        result = await users_col.update_one({'user_id': user.id}, {'$setOnInsert': new_user}, upsert=True)
+    except DuplicateKeyError:
+        # A concurrent /start won the insert
+        return False
+    if result.upserted_id is None:
+        return False
+    stats_engine.on_user_added()
+    activity_tracker.on_user_created(user.id)
+    user_cache.put({'user_id': user.id, **new_user})
     
     if LOG_CHANNEL_ID:
-        await log_to_channel(
+        log_to_channel(
             f"#NewUser Joined 🚀\n\n"
             f"👤 Name: {user.first_name}\n"
             f"🆔 ID: {user.id}\n"
@@ -94,62 +268,77 @@ async def add_user(user, referrer_id=None):
     return True
 
 async def update_referral_reward(referrer_id):
-    referrer = await get_user(referrer_id)
-    if referrer:
-        await users_col.update_one(
-            {'user_id': referrer_id},
-            {
-                '$inc': {'balance': 1.0, 'referral_count': 1},
-                '$set': {'last_active': datetime.datetime.now()}
-            }
-        )
+    # Matches nothing when the referrer doesn't exist, no read needed first
+    referrer = await user_cache.update(
+        {'user_id': referrer_id},
+        {'$inc': {'balance': 1.0, 'referral_count': 1}}
+    )
+    if referrer is not None:
+        await asyncio.gather(leaderboard.on_referral(referrer_id), shard_invalidations.publish(referrer_id))
+
+async def onboard_user(user, referrer_id=None):
+    # Only the request that actually created the user credits the referrer
+    is_new = await add_user(user, referrer_id)
+    if is_new and referrer_id:
+        await update_referral_reward(referrer_id)
+    return is_new
 
 async def get_stats():
-    total_users = await users_col.count_documents({})
-    today_start = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    active_today = await users_col.count_documents({'last_active': {'$gte': today_start}})
-    
-    total_coupons = await coupons_col.count_documents({})
-    used_coupons = await coupons_col.count_documents({'is_used': True})
-    available_coupons = await coupons_col.count_documents({'is_used': False})
-    
-    stock = {}
-    for amount in COUPON_COSTS.keys():
-        count = await coupons_col.count_documents({'amount': amount, 'is_used': False})
-        stock[amount] = count
-        
-    return {
-        'total_users': total_users,
-        'active_today': active_today,
-        'total_coupons': total_coupons,
-        'used_coupons': used_coupons,
-        'available_coupons': available_coupons,
-        'stock': stock
-    }
+    # Served from in-memory counters, no collection scans
+    return await stats_engine.snapshot()
+
+def iter_codes(lines):
+    for line in lines:
+        code = line.strip()
+        if code:
+            yield code
 
-async def add_coupons_to_db(codes, amount, admin_id):
+async def add_coupons_to_db(codes, amount, admin_id, progress=None):
+    # Bulk import: chunked insert_many, duplicates rejected by the unique index on 'code'
     added_count = 0
     duplicates = 0
-    
-    for code in codes:
-        code = code.strip()
-        if not code: continue
-        
-        exists = await coupons_col.find_one({'code': code})
-        if exists:
-            duplicates += 1
-            continue
-            
-        await coupons_col.insert_one({
+    codes = iter_codes(codes)
+
+    while True:
+        chunk = list(itertools.islice(codes, COUPON_IMPORT_CHUNK))
+        if not chunk:
+            break
+        # Used coupons moved to an archive are out of reach of the unique index
+        archived = await archiver.archived_codes(chunk)
+        if archived:
+            duplicates += len(archived)
+            chunk = [code for code in chunk if code not in archived]
+            if not chunk:
+                continue
+
+        now = datetime.datetime.now()
+        docs = [{
             'code': code,
             'amount': amount,
             'is_used': False,
-            'added_at': datetime.datetime.now(),
+            'added_at': now,
             'used_by': None,
             'used_at': None
-        })
-        added_count += 1
-    
+        } for code in chunk]
+
+        try:
+            result = await coupons_col.insert_many(docs, ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            inserted = e.details.get('nInserted', 0)
+            errors = e.details.get('writeErrors', [])
+            dup = sum(1 for err in errors if err.get('code') == 11000)
+            duplicates += dup
+            if dup != len(errors):
+                added_count += inserted
+                stats_engine.on_coupons_added(amount, inserted)
+                raise
+
+        added_count += inserted
+        stats_engine.on_coupons_added(amount, inserted)
+        if progress:
+            await progress(added_count, duplicates)
+
     await admin_logs_col.insert_one({
         'admin_id': admin_id,
         'action': f"add_coupons_{amount}",
@@ -161,8 +350,18 @@ async def add_coupons_to_db(codes, amount, admin_id):
 
 # --- NEW: BATCH DELETE FUNCTION ---
 async def delete_coupons_from_db(codes, admin_id):
+    # Snapshot what is about to go so the stats counters stay exact
+    breakdown = {}
+    async for row in coupons_col.aggregate([
+        {'$match': {'code': {'$in': codes}}},
+        {'$group': {'_id': {'amount': '$amount', 'is_used': '$is_used'}, 'n': {'$sum': 1}}}
+    ]):
+        breakdown[(row['_id'].get('amount'), bool(row['_id'].get('is_used')))] = row['n']
+
     # Optimisation: Use delete_many for single query speed
     result = await coupons_col.delete_many({'code': {'$in': codes}})
+    if result.deleted_count > 0:
+        stats_engine.on_coupons_deleted(breakdown)
     
     if result.deleted_count > 0:
         await admin_logs_col.insert_one({
@@ -174,78 +373,57 @@ async def delete_coupons_from_db(codes, admin_id):
     return result.deleted_count
 
 async def process_redemption(user_id, cost, amount):
-    user = await get_user(user_id)
-    if not user or user['balance'] < cost:
-        return None, "insufficient_balance"
-    
-    coupon = await coupons_col.find_one_and_update(
-        {'amount': amount, 'is_used': False},
-        {'$set': {'is_used': True, 'used_by': user_id, 'used_at': datetime.datetime.now()}}
-    )
-    
-    if not coupon:
-        return None, "out_of_stock"
-    
-    await users_col.update_one(
-        {'user_id': user_id},
-        {'$inc': {'balance': -float(cost)}}
-    )
-    
-    await redeemed_col.insert_one({
-        'user_id': user_id,
-        'code': coupon['code'],
-        'redeemed_at': datetime.datetime.now()
-    })
-    
-    return coupon['code'], "success"
+    # Guarded debit + coupon claim + history record, committed together
+    code, balance, status = await redemption_engine.redeem(user_id, cost, amount)
+    if status == "success":
+        stats_engine.on_coupon_redeemed(amount)
+        user_cache.on_redeemed(user_id, balance, {'code': code, 'amount': amount, 'redeemed_at': datetime.datetime.now()})
+    return code, balance, status
 
 # --- HELPER FUNCTIONS ---
 
-bot_instance = None
+# Every worker has its own dispatcher, so each gets its share of the channel's rate
+log_dispatcher = LogDispatcher(LOG_CHANNEL_ID, LOG_CHANNEL_INTERVAL * SHARD_COUNT)
 
-async def log_to_channel(message):
-    if bot_instance and LOG_CHANNEL_ID:
-        try:
-            await bot_instance.send_message(chat_id=LOG_CHANNEL_ID, text=message)
-        except Exception as e:
-            logger.error(f"Failed to log: {e}")
+# --- 📈 METRICS ---
+REGISTRY.gauge("bot_cache_hit_ratio", "Hit ratio of in-memory caches", lambda: {
+    'fsub_membership': user_fsub_cache.members.hit_ratio(),
+    'user_profile': user_cache.profiles.hit_ratio(),
+}, ["cache"])
+REGISTRY.gauge("bot_cache_entries", "Entries held by in-memory caches", lambda: {
+    'fsub_membership': len(user_fsub_cache.members),
+    'user_profile': len(user_cache.profiles),
+    'throttle_buckets': sum(len(b.buckets) for b in flood_control.budgets.values()),
+}, ["cache"])
+REGISTRY.gauge("bot_log_queue_size", "Log-channel lines waiting to be sent", lambda: log_dispatcher.queue.qsize())
+REGISTRY.gauge("bot_log_dropped_total", "Log-channel lines dropped because the queue was full", lambda: log_dispatcher.dropped)
 
-async def is_member(user_id, bot):
-    if not FSUB_CHANNEL_IDS: return True
-    for channel_id in FSUB_CHANNEL_IDS:
-        try:
-            member = await bot.get_chat_member(channel_id, user_id)
-            if member.status not in ['member', 'administrator', 'creator']:
-                return False
-        except Exception as e:
-            logger.error(f"Error checking channel {channel_id}: {e}")
-            return False
-    return True
+# --- 🛡 DEGRADED MODE ---
+UNAVAILABLE_TEXT = "⚠️ We're having a temporary problem on our side. Please try again in a minute."
+
+def mongo_available(*collections):
+    # No side effects: an open circuit whose probe is due still counts as available
+    return all(breakers[f"mongo:{name}"].available for name in collections)
+
+def log_to_channel(message):
+    # Only an enqueue: delivery, batching and flood control happen in the background
+    log_dispatcher.enqueue(message)
+
+async def is_member(user_id, bot, use_cache=True):
+    # All channels are checked concurrently; results (positive and negative) are cached
+    return await user_fsub_cache.is_member(user_id, bot, use_cache)
 
 async def validate_user_fsub(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    current_time = time.time()
     
-    # 1. Check Cache
-    last_check = user_fsub_cache.get(user.id, 0)
-    if current_time - last_check < CACHE_DURATION:
+    # 1. Check Cache / API
+    if await is_member(user.id, context.bot):
         return True
-        
-    # 2. Check API
-    is_sub = await is_member(user.id, context.bot)
     
-    if is_sub:
-        user_fsub_cache[user.id] = current_time 
-        return True
-    
-    # 3. Fail
+    # 2. Fail (invite links come from a per-channel cache)
     buttons = []
-    for i, ch_id in enumerate(FSUB_CHANNEL_IDS, 1):
-        try:
-            chat = await context.bot.get_chat(ch_id)
-            link = chat.invite_link or f"https://t.me/c/{str(ch_id)[4:]}/1"
-        except:
-            link = "#"
+    links = await user_fsub_cache.invite_links(context.bot)
+    for i, link in enumerate(links, 1):
         buttons.append([InlineKeyboardButton(f"📢 Join Channel {i}", url=link)])
     
     buttons.append([InlineKeyboardButton("✅ I've Joined", callback_data="check_join")])
@@ -265,6 +443,12 @@ async def validate_user_fsub(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 # --- HANDLERS ---
 
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Group -1 sees every update; last_active is written in batches, not per tap
+    if update.effective_user:
+        activity_tracker.touch(update.effective_user.id)
+
+@instrumented
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     args = context.args
@@ -280,27 +464,24 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data['referrer_id'] = referrer_id
         return
 
-    is_new = await add_user(user, referrer_id)
-    
-    db_user = await get_user(user.id)
-    if is_new and db_user.get('referred_by'):
-        await update_referral_reward(db_user['referred_by'])
+    # Persisted across restarts until used; a direct /start supersedes it
+    context.user_data.pop('referrer_id', None)
+    await onboard_user(user, referrer_id)
 
     await show_main_menu(update, context)
 
+@instrumented
 async def check_join_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     user = query.from_user
     await query.answer()
 
-    is_sub = await is_member(user.id, context.bot)
+    # The user says they just joined, so skip the (possibly negative) cached answer
+    is_sub = await is_member(user.id, context.bot, use_cache=False)
     
     if is_sub:
-        user_fsub_cache[user.id] = time.time()
-        referrer_id = context.user_data.get('referrer_id')
-        is_new = await add_user(user, referrer_id)
-        if is_new and referrer_id:
-            await update_referral_reward(referrer_id)
+        referrer_id = context.user_data.pop('referrer_id', None)
+        await onboard_user(user, referrer_id)
         await query.message.delete()
         await show_main_menu(update, context)
     else:
@@ -309,7 +490,8 @@ async def check_join_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [KeyboardButton("🔗 My Link"), KeyboardButton("💎 Balance")],
-        [KeyboardButton("🎟 Coupon Stock"), KeyboardButton("💸 Withdraw")]
+        [KeyboardButton("🎟 Coupon Stock"), KeyboardButton("💸 Withdraw")],
+        [KeyboardButton("🏆 Leaderboard")]
     ]
     markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
@@ -324,6 +506,7 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.callback_query.message.reply_text(text, reply_markup=markup)
 
+@instrumented
 async def my_link_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await validate_user_fsub(update, context): return
     
@@ -342,15 +525,27 @@ async def my_link_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     buttons = [[InlineKeyboardButton("📤 Share Link", url=f"https://t.me/share/url?url={ref_link}&text=Get%20Free%20Shein%20Coupons!")]]
     await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=InlineKeyboardMarkup(buttons))
 
+@instrumented
 async def balance_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await validate_user_fsub(update, context): return
 
     user_id = update.effective_user.id
-    user_data = await get_user(user_id)
+    stale = False
+    try:
+        user_data = await get_user(user_id)
+    except UNAVAILABLE_ERRORS:
+        # Database down: the last profile we held is better than no answer
+        user_data = user_cache.stale(user_id)
+        if user_data is None:
+            await update.message.reply_text(UNAVAILABLE_TEXT)
+            return
+        stale = True
     
     balance = user_data.get('balance', 0.0)
-    redeemed_count = await redeemed_col.count_documents({'user_id': user_id})
-    last_redeem = await redeemed_col.find_one({'user_id': user_id}, sort=[('redeemed_at', -1)])
+    # Maintained by the redemption write path, see --backfill-redemptions for old users
+    redeemed_count = user_data.get('redeemed_count', 0)
+    recent = user_data.get('recent_redemptions') or []
+    last_redeem = recent[0] if recent else None
     history_text = f"\n• {last_redeem['code']} ({last_redeem['redeemed_at'].strftime('%Y-%m-%d')})" if last_redeem else "\nNo redemptions yet."
     
     text = (
@@ -359,22 +554,63 @@ async def balance_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"<b>Redeem:</b> {redeemed_count}\n\n"
         f"<i>Redeem History:</i>{history_text}"
     )
+    if stale:
+        text += "\n\n<i>⚠️ Last known balance, live data is temporarily unavailable.</i>"
     await update.message.reply_text(text, parse_mode=ParseMode.HTML)
 
+@instrumented
 async def stock_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await validate_user_fsub(update, context): return
 
-    stats = await get_stats()
-    stock = stats['stock']
+    # Live counts from the change stream, no query per tap
+    stock = stock_watcher.stock
+    lines = [
+        f"• {amount} Coupons: {stock[amount]}" if stock.get(amount) else f"• {amount} Coupons: ❌ Sold out"
+        for amount in COUPON_COSTS
+    ]
+    text = f"🎟 <b>Coupon Stock</b>\n\n" + "\n".join(lines)
+    if not mongo_available('coupons'):
+        text += "\n\n<i>⚠️ Last known counts, live data is temporarily unavailable.</i>"
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+
+async def render_leaderboard(user_id, board):
+    top = await leaderboard.top(board)
+    profile = await get_user(user_id)
+    rank, count = await leaderboard.rank(user_id, board, profile.get('referral_count', 0) if profile else 0)
+
+    title = "📅 This Week's Top Referrers" if board == 'week' else "🏆 All-Time Top Referrers"
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = [
+        f"{medals.get(pos, f'{pos}.')} {html.escape(name or 'User')} — {refs} 👥"
+        for pos, (_, name, refs) in enumerate(top, 1)
+    ]
+    board_text = "\n".join(lines) if lines else "No referrals yet. Be the first!"
+    your_rank = f"#{rank}" if rank else "Unranked"
     text = (
-        f"🎟 <b>Coupon Stock</b>\n\n"
-        f"• 500 Coupons: {stock.get(500, 0)}\n"
-        f"• 1000 Coupons: {stock.get(1000, 0)}\n"
-        f"• 2000 Coupons: {stock.get(2000, 0)}\n"
-        f"• 4000 Coupons: {stock.get(4000, 0)}"
+        f"<b>{title}</b>\n\n"
+        f"{board_text}\n\n"
+        f"<b>Your Rank:</b> {your_rank} ({count} 👥)"
     )
-    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+    switch = ("🏆 All Time", "lb_all") if board == 'week' else ("📅 This Week", "lb_week")
+    keyboard = [[InlineKeyboardButton(switch[0], callback_data=switch[1])]]
+    return text, InlineKeyboardMarkup(keyboard)
 
+@instrumented
+async def leaderboard_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await validate_user_fsub(update, context): return
+
+    text, markup = await render_leaderboard(update.effective_user.id, 'all')
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=markup)
+
+@instrumented
+async def leaderboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    board = 'week' if query.data == "lb_week" else 'all'
+    text, markup = await render_leaderboard(query.from_user.id, board)
+    await query.message.edit_text(text, parse_mode=ParseMode.HTML, reply_markup=markup)
+
+@instrumented
 async def withdraw_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await validate_user_fsub(update, context): return
 
@@ -390,19 +626,23 @@ async def withdraw_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
+    # Sold-out denominations are hidden before anyone taps them
+    available = stock_watcher.available()
+    buttons = [
+        InlineKeyboardButton(f"{COUPON_COSTS[amount]} 💎 = {amount} 🎟 ", callback_data=f"redeem_{amount}")
+        for amount in available
+    ]
     text = (
         f"💸 <b>Withdraw</b>\n\n"
         f"<b>Total Balance:</b> {balance} 💎\n"
-        f"<b>Select amount to withdraw:</b>"
     )
+    text += "<b>Select amount to withdraw:</b>" if available else "❌ All coupons are out of stock right now. Please check back later!"
     
-    keyboard = [
-        [InlineKeyboardButton("1 💎 = 500 🎟 ", callback_data="redeem_500"), InlineKeyboardButton("5 💎 = 1000 🎟 ", callback_data="redeem_1000")],
-        [InlineKeyboardButton("25 💎 = 2000 🎟 ", callback_data="redeem_2000"), InlineKeyboardButton("35 💎 = 4000 🎟 ", callback_data="redeem_4000")],
-        [InlineKeyboardButton("🔙 Back", callback_data="close_withdraw")]
-    ]
+    keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="close_withdraw")])
     await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@instrumented
 async def redeem_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     if not await validate_user_fsub(update, context): 
@@ -418,12 +658,18 @@ async def redeem_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     amount = int(data.split("_")[1])
     cost = COUPON_COSTS[amount]
-    
-    code, status = await process_redemption(user.id, cost, amount)
+
+    # Rejected up front: a redemption is never started against a failing database
+    if not mongo_available('users', 'coupons', 'redeemed'):
+        await query.answer("⚠️ Redemptions are paused for a moment. Your balance is safe, please try again shortly.", show_alert=True)
+        return
+    try:
+        code, balance, status = await process_redemption(user.id, cost, amount)
+    except UNAVAILABLE_ERRORS:
+        await query.answer("⚠️ Redemption could not be completed right now. Please check your balance and try again shortly.", show_alert=True)
+        return
     
     if status == "success":
-        user_data = await get_user(user.id)
-        balance = user_data.get('balance', 0.0)
         await query.message.edit_text(
             f"✅ Coupon Redeemed Successfully!\n\n"
             f"🎟 Code: <code>{code}</code>\n"
@@ -434,13 +680,12 @@ async def redeem_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode=ParseMode.HTML
         )
         if LOG_CHANNEL_ID:
-            await context.bot.send_message(
-                chat_id=LOG_CHANNEL_ID,
-                text=f"🎟 New Redemption\n\n"
-                     f"👤 User: {user.first_name} (ID: {user.id})\n"
-                     f"💰 Amount: {amount} 🎟 \n"
-                     f"🔢 Code: {code}\n"
-                     f"🕒 Time: {datetime.datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}"
+            log_to_channel(
+                f"🎟 New Redemption\n\n"
+                f"👤 User: {user.first_name} (ID: {user.id})\n"
+                f"💰 Amount: {amount} 🎟 \n"
+                f"🔢 Code: {code}\n"
+                f"🕒 Time: {datetime.datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}"
             )
     elif status == "out_of_stock":
         await query.answer(f"❌ {amount} 🎟  coupons are out of stock!", show_alert=True)
@@ -453,13 +698,29 @@ async def redeem_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Invite friends to earn more coins."
         )
 
+@instrumented
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Someone joined or left a force-sub channel: drop their cached membership
+    user_fsub_cache.on_chat_member(update.chat_member)
+
+@instrumented
+async def bot_blocked_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # A user blocked or unblocked the bot; broadcasts skip blocked users
+    member = update.my_chat_member
+    if member.chat.type != ChatType.PRIVATE:
+        return
+    blocked = member.new_chat_member.status == ChatMember.BANNED
+    await users_col.update_one({'user_id': member.chat.id}, {'$set': {'blocked': blocked}})
+
 # --- ADMIN COMMANDS ---
 
+@instrumented
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id not in ADMIN_IDS: return
     await show_admin_panel(update, context)
 
 # 🛑 NEW: DELETE COUPON COMMAND 🛑
+@instrumented
 async def delete_coupons_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id not in ADMIN_IDS: return
@@ -477,28 +738,117 @@ async def delete_coupons_command(update: Update, context: ContextTypes.DEFAULT_T
     else:
         await update.message.reply_text("⚠️ No coupons found with those codes.")
 
+@instrumented
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS: return
+
+    if context.args and context.args[0].lower() == "stop":
+        cancelled = await broadcast_engine.cancel()
+        await update.message.reply_text("⏹ Broadcast stopped." if cancelled else "⚠️ No broadcast is running.")
+        return
+
+    source = update.message.reply_to_message
+    if not source:
+        await update.message.reply_text("❌ Reply to the message you want to send with /broadcast\n(/broadcast stop to cancel)")
+        return
+
+    stats = await get_stats()
+    job = await broadcast_engine.start(context.bot, source.chat_id, source.message_id, user_id, stats['total_users'])
+    if job is None:
+        await update.message.reply_text("⚠️ A broadcast is already running. Check /admin for progress.")
+        return
+    await update.message.reply_text(f"📣 Broadcast started to ~{job['total']} users. Check /admin for progress.")
+    if LOG_CHANNEL_ID:
+        log_to_channel(
+            f"📣 Broadcast Started\n\n"
+            f"👮‍♂️ Admin ID: {user_id}\n"
+            f"🕒 Time: {datetime.datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}"
+        )
+
+@instrumented
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS: return
+
+    try:
+        collection, fmt, query = parse_export_args(context.args)
+    except ExportError as e:
+        await update.message.reply_text(
+            f"❌ {e}\n\n"
+            f"Usage: `/export users|coupons|redeemed [csv|jsonl] [from=YYYY-MM-DD] [to=YYYY-MM-DD] [used|unused] [amount=500]`",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+
+    status_msg = await update.message.reply_text(f"⏳ Exporting {collection}...")
+    last_edit = time.time()
+
+    async def report_progress(rows):
+        nonlocal last_edit
+        if time.time() - last_edit < 2:
+            return
+        last_edit = time.time()
+        try:
+            await status_msg.edit_text(f"⏳ Exporting {collection}...\n\n📄 Rows: {rows}")
+        except Exception as e:
+            logger.warning(f"Progress update failed: {e}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths, rows = await export_collection(db, collection, fmt, query, tmp_dir, EXPORT_BATCH_SIZE,
+                                              progress=report_progress, sources=await archiver.sources(collection))
+        for index, path in enumerate(paths, 1):
+            part = f" (part {index}/{len(paths)})" if len(paths) > 1 else ""
+            with open(path, 'rb') as fh:
+                await context.bot.send_document(
+                    chat_id=update.effective_chat.id, document=fh, filename=os.path.basename(path),
+                    caption=f"📦 {collection} export{part}", write_timeout=300, read_timeout=300
+                )
+
+    await status_msg.edit_text(f"✅ Exported {rows} {collection} row(s) in {len(paths)} file(s).")
+    await admin_logs_col.insert_one({
+        'admin_id': user_id,
+        'action': f"export_{collection}",
+        'details': f"Exported {rows} rows ({fmt}) with filter {query}",
+        'timestamp': datetime.datetime.now()
+    })
+
 async def show_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     stats = await get_stats()
+    dau, wau = await activity_tracker.active_counts()
+    broadcast = await broadcast_engine.progress()
+    broadcast_text = ""
+    if broadcast:
+        done = broadcast['sent'] + broadcast['blocked'] + broadcast['failed']
+        broadcast_text = (
+            f"📣 Broadcast ({broadcast['status']}): {done}/{broadcast['total']}\n"
+            f"   ✅ {broadcast['sent']} sent • 🚫 {broadcast['blocked']} blocked • ⚠️ {broadcast['failed']} failed\n\n"
+        )
     text = (
         f"👑 Admin Panel\n\n"
         f"👥 Total Users: {stats['total_users']}\n"
-        f"🟢 Active Today: {stats['active_today']}\n"
+        f"🟢 Active Today: {dau}\n"
+        f"📅 Active This Week: {wau}\n"
         f"🎟 Total Coupons: {stats['total_coupons']}\n"
         f"✅ Used Coupons: {stats['used_coupons']}\n"
         f"🔄 Available: {stats['available_coupons']}\n\n"
+        f"{broadcast_text}"
         f"Select an option:"
     )
     keyboard = [
         [InlineKeyboardButton("➕ Add 500 Coupons", callback_data="add_c_500"), InlineKeyboardButton("➕ Add 1000 Coupons", callback_data="add_c_1000")],
         [InlineKeyboardButton("➕ Add 2000 Coupons", callback_data="add_c_2000"), InlineKeyboardButton("➕ Add 4000 Coupons", callback_data="add_c_4000")],
         [InlineKeyboardButton("📊 Statistics", callback_data="admin_stats"), InlineKeyboardButton("🔄 Reload Data", callback_data="admin_reload")],
-        [InlineKeyboardButton("🔙 Back to Main", callback_data="admin_close")]
     ]
+    if broadcast and broadcast['status'] == 'running':
+        keyboard.append([InlineKeyboardButton("⏹ Stop Broadcast", callback_data="admin_bc_stop")])
+    keyboard.append([InlineKeyboardButton("🔙 Back to Main", callback_data="admin_close")])
     if update.callback_query:
         await update.callback_query.message.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
     else:
         await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
+@instrumented
 async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
@@ -509,12 +859,20 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data == "admin_reload":
         await show_admin_panel(update, context)
         return
+    if data == "admin_bc_stop":
+        if query.from_user.id not in ADMIN_IDS: return
+        await broadcast_engine.cancel()
+        await query.answer("⏹ Broadcast stopped.")
+        await show_admin_panel(update, context)
+        return
     if data == "admin_stats":
         stats = await get_stats()
+        dau, wau = await activity_tracker.active_counts()
         text = (
             f"📊 Bot Statistics\n\n"
             f"👥 Total Users: {stats['total_users']}\n"
-            f"🟢 Active Today: {stats['active_today']}\n"
+            f"🟢 Active Today: {dau}\n"
+            f"📅 Active This Week: {wau}\n"
             f"🎟 Total Coupons: {stats['total_coupons']}\n"
             f"✅ Used Coupons: {stats['used_coupons']}\n"
             f"🔄 Available: {stats['available_coupons']}\n\n"
@@ -530,18 +888,79 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data.startswith("add_c_"):
+        if not mongo_available('coupons'):
+            await query.answer("⚠️ The database is not responding, coupon uploads are paused.", show_alert=True)
+            return
         amount = int(data.split("_")[2])
         context.user_data['add_coupon_amount'] = amount
-        await query.message.reply_text(f"Please send coupon codes for {amount} 🎟  (one per line):")
+        await query.message.reply_text(f"Please send coupon codes for {amount} 🎟  (one per line), or upload a .txt/.csv file:")
         return WAITING_FOR_COUPONS
 
+# Re-sending is safe: the unique index turns already imported codes into duplicates
+IMPORT_INTERRUPTED_TEXT = (
+    "⚠️ The database stopped responding and the import was interrupted.\n"
+    "Send the same codes again in a minute; the ones already added will be skipped as duplicates."
+)
+
+@instrumented
 async def process_add_coupons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     amount = context.user_data.get('add_coupon_amount')
     admin_id = update.effective_user.id
     if not amount: return ConversationHandler.END
     codes = text.splitlines()
-    added, duplicates = await add_coupons_to_db(codes, amount, admin_id)
+    try:
+        added, duplicates = await add_coupons_to_db(codes, amount, admin_id)
+    except UNAVAILABLE_ERRORS:
+        await update.message.reply_text(IMPORT_INTERRUPTED_TEXT)
+        return WAITING_FOR_COUPONS
+    await finish_coupon_import(update, context, amount, added, duplicates)
+    return ConversationHandler.END
+
+@instrumented
+async def process_coupon_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    amount = context.user_data.get('add_coupon_amount')
+    admin_id = update.effective_user.id
+    if not amount: return ConversationHandler.END
+
+    document = update.message.document
+    status_msg = await update.message.reply_text(f"⏳ Importing {document.file_name}...")
+    last_edit = 0
+
+    async def report_progress(added, duplicates):
+        nonlocal last_edit
+        # Editing on every chunk would hit Telegram's edit limits on big files
+        if time.time() - last_edit < 2:
+            return
+        last_edit = time.time()
+        try:
+            await status_msg.edit_text(f"⏳ Importing {document.file_name}...\n\n🎟 Added: {added}\n📊 Duplicates: {duplicates}")
+        except Exception as e:
+            logger.warning(f"Progress update failed: {e}")
+
+    tg_file = await document.get_file()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "coupons")
+            await tg_file.download_to_drive(path)
+            # Read line by line, the file never sits in memory as a whole
+            with open(path, encoding="utf-8-sig", errors="ignore", newline="") as fh:
+                if document.file_name and document.file_name.lower().endswith(".csv"):
+                    lines = (row[0] for row in csv.reader(fh) if row and row[0].strip().lower() != "code")
+                else:
+                    lines = fh
+                added, duplicates = await add_coupons_to_db(lines, amount, admin_id, progress=report_progress)
+    except UNAVAILABLE_ERRORS:
+        await status_msg.edit_text(IMPORT_INTERRUPTED_TEXT)
+        return WAITING_FOR_COUPONS
+
+    await status_msg.delete()
+    await finish_coupon_import(update, context, amount, added, duplicates)
+    return ConversationHandler.END
+
+async def finish_coupon_import(update: Update, context: ContextTypes.DEFAULT_TYPE, amount, added, duplicates):
+    admin_id = update.effective_user.id
+    context.user_data.pop('add_coupon_amount', None)
     stats = await get_stats()
     stock = stats['stock']
     reply_text = (
@@ -557,59 +976,252 @@ async def process_add_coupons(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
     await update.message.reply_text(reply_text)
     if LOG_CHANNEL_ID:
-        await context.bot.send_message(
-            chat_id=LOG_CHANNEL_ID,
-            text=f"👑 Admin Action\n\n"
-                 f"👤 Admin: {update.effective_user.first_name} (ID: {admin_id})\n"
-                 f"🎟 Added: {added} x {amount} 🎟  coupons\n"
-                 f"🕒 Time: {datetime.datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}"
+        log_to_channel(
+            f"👑 Admin Action\n\n"
+            f"👤 Admin: {update.effective_user.first_name} (ID: {admin_id})\n"
+            f"🎟 Added: {added} x {amount} 🎟  coupons\n"
+            f"🕒 Time: {datetime.datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}"
         )
-    return ConversationHandler.END
 
+@instrumented
 async def cancel_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.pop('add_coupon_amount', None)
     await update.message.reply_text("Action cancelled.")
     return ConversationHandler.END
 
-# --- MAIN EXECUTION ---
-def main():
-    global bot_instance
-    if not BOT_TOKEN:
-        print("Error: BOT_TOKEN not found in environment variables!")
+async def on_error(update, context: ContextTypes.DEFAULT_TYPE):
+    if not isinstance(context.error, UNAVAILABLE_ERRORS):
+        logger.error("Exception while handling an update", exc_info=context.error)
+        return
+    # Outages are already logged by the breakers; tell the user instead of leaving them hanging
+    logger.warning(f"Update failed on an unavailable dependency: {context.error!r}")
+    if not isinstance(update, Update):
         return
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(UNAVAILABLE_TEXT, show_alert=True)
+        elif update.effective_message:
+            await update.effective_message.reply_text(UNAVAILABLE_TEXT)
+    except Exception as e:
+        logger.warning(f"Could not send the outage notice: {e}")
 
-    # Start Flask
-    flask_thread = threading.Thread(target=run_flask)
-    flask_thread.daemon = True
-    flask_thread.start()
-    print("Flask Server running in background...")
+# --- LIFECYCLE ---
 
-    # Start Bot
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
-    bot_instance = application.bot
+async def on_startup(application):
+    await ensure_indexes(db)
+    if INDEX_SELF_CHECK:
+        await verify_query_plans(db)
+    try:
+        await stats_engine.reconcile()
+    except Exception as e:
+        logger.error(f"Initial stats reconcile failed: {e}")
+    stats_engine.start()
+    activity_tracker.start()
+    await stock_watcher.start()
+    leaderboard.start()
+    archiver.start()
+    shard_invalidations.start()
+    if coupon_pool:
+        await coupon_pool.start()
+    log_dispatcher.start(application.bot)
+    await broadcast_engine.resume(application.bot)
+
+async def on_stop(application):
+    # Runs before the bot's HTTP client is closed, so queued log lines can still go out
+    await broadcast_engine.stop()
+    await log_dispatcher.stop()
+
+async def on_shutdown(application):
+    await stats_engine.stop()
+    await activity_tracker.stop()
+    await stock_watcher.stop()
+    await leaderboard.stop()
+    await archiver.stop()
+    await shard_invalidations.stop()
+    if coupon_pool:
+        await coupon_pool.stop()
+
+# --- MAIN EXECUTION ---
+async def check_indexes():
+    await ensure_indexes(db)
+    await verify_query_plans(db)
+    print("✅ All hot queries are index-backed.")
+
+async def backfill_redemptions():
+    updated = await backfill_redemption_summaries(users_col, redeemed_col, archives=await archiver.archives('redeemed'))
+    print(f"✅ Redemption summaries updated for {updated} user(s).")
+
+async def archive_now():
+    await ensure_indexes(db)
+    moved = await archiver.run_once()
+    print(f"✅ Archived {moved['coupons']} used coupon(s) and {moved['redeemed']} redemption(s) "
+          f"older than {ARCHIVE_AFTER_DAYS} days.")
+
+def build_application(request=None):
+    # Bot API calls are timed, 429s counted for /metrics, and fail fast while Telegram is down
+    request = request or GuardedRequest(breakers['telegram'], connection_pool_size=256,
+                                        connect_timeout=BOT_API_TIMEOUT, read_timeout=BOT_API_TIMEOUT)
+    builder = ApplicationBuilder().token(BOT_TOKEN).request(request)
+    # Pending referrals and half-finished coupon uploads survive restarts
+    builder = builder.persistence(MongoPersistence(db['persistence'], PERSISTENCE_INTERVAL))
+    if CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(UserOrderedUpdateProcessor(CONCURRENT_UPDATES))
+    if BOT_MODE in ("webhook", "worker"):
+        # Updates arrive through the web server, no Updater needed
+        builder = builder.updater(None)
+    application = builder.build()
     
     conv_handler = ConversationHandler(
         entry_points=[CallbackQueryHandler(admin_callback, pattern="^add_c_")],
-        states={WAITING_FOR_COUPONS: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_add_coupons)]},
-        fallbacks=[CommandHandler('cancel', cancel_add)]
+        states={WAITING_FOR_COUPONS: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, process_add_coupons),
+            MessageHandler(filters.Document.FileExtension("txt") | filters.Document.FileExtension("csv"), process_coupon_file)
+        ]},
+        fallbacks=[CommandHandler('cancel', cancel_add)],
+        name="add_coupons",
+        persistent=True
     )
     
+    # Group -2 runs first and stops throttled updates before anything else sees them
+    application.add_handler(TypeHandler(Update, flood_control), group=-2)
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("admin", admin_command))
     application.add_handler(CommandHandler("delete", delete_coupons_command)) # ✅ NEW COMMAND
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("export", export_command))
     application.add_handler(CallbackQueryHandler(check_join_callback, pattern="^check_join$"))
+    application.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.CHAT_MEMBER))
+    application.add_handler(ChatMemberHandler(bot_blocked_update, ChatMemberHandler.MY_CHAT_MEMBER))
     
     application.add_handler(MessageHandler(filters.Regex("^🔗 My Link$"), my_link_handler))
     application.add_handler(MessageHandler(filters.Regex("^💎 Balance$"), balance_handler))
     application.add_handler(MessageHandler(filters.Regex("^🎟 Coupon Stock$"), stock_handler))
     application.add_handler(MessageHandler(filters.Regex("^💸 Withdraw$"), withdraw_handler))
+    application.add_handler(MessageHandler(filters.Regex("^🏆 Leaderboard$"), leaderboard_handler))
     
     application.add_handler(conv_handler)
     application.add_handler(CallbackQueryHandler(admin_callback, pattern="^admin_"))
     application.add_handler(CallbackQueryHandler(redeem_callback, pattern="^redeem_"))
     application.add_handler(CallbackQueryHandler(redeem_callback, pattern="^close_withdraw"))
-    
-    print("Bot is polling (Light Speed Mode with /delete 🚀)...")
-    application.run_polling(drop_pending_updates=True)
+    application.add_handler(CallbackQueryHandler(leaderboard_callback, pattern="^lb_"))
+    application.add_error_handler(on_error)
+    return application
+
+def stop_on_signals():
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    return stop_event
+
+async def set_webhook(bot):
+    # chat_member updates are opt-in; they drive force-sub cache invalidation
+    await bot.set_webhook(
+        url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=True
+    )
+
+async def run_bot(application):
+    # One event loop runs the bot and the web server (health + webhook)
+    stop_event = stop_on_signals()
+
+    webhook = BOT_MODE == "webhook"
+    worker = BOT_MODE == "worker"
+    web_app = build_web_app(application, WEBHOOK_PATH if webhook else None, WEBHOOK_SECRET, breakers.values(),
+                            routed_path=ROUTED_PATH if worker else None, routed_secret=ROUTED_SECRET)
+
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    if webhook:
+        await set_webhook(application.bot)
+    elif application.updater:
+        await application.updater.start_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
+    # Workers are only ever reached by their router, on this machine
+    runner = await start_web_server(web_app, PORT, host="127.0.0.1" if worker else "0.0.0.0")
+    print(f"Bot is running in {BOT_MODE} mode on port {PORT} (Light Speed Mode with /delete 🚀)...")
+
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        await on_stop(application)
+        await application.shutdown()
+        await on_shutdown(application)
+
+async def run_router():
+    # No handlers here: updates are only parsed far enough to pick a shard
+    stop_event = stop_on_signals()
+    # The workers always check this, even when Telegram's webhook runs without a secret
+    routed_secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    # Not WORKER_ID's hostname:pid default: worker ids must survive a router restart
+    worker_prefix = os.getenv("WORKER_ID") or socket.gethostname()
+    supervisor = WorkerSupervisor(SHARD_COUNT, WORKER_BASE_PORT, os.path.abspath(__file__), worker_prefix, routed_secret)
+    router = UpdateRouter([supervisor.url(shard, ROUTED_PATH) for shard in range(SHARD_COUNT)], routed_secret)
+    supervisor.start()
+    await router.start()
+    runner = await start_web_server(build_router_app(router, WEBHOOK_PATH, WEBHOOK_SECRET), PORT)
+    async with Bot(BOT_TOKEN) as bot:
+        await set_webhook(bot)
+    print(f"Router is running on port {PORT} with {SHARD_COUNT} worker(s) from port {WORKER_BASE_PORT}...")
+
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        await router.stop()
+        await supervisor.stop()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check-indexes", action="store_true", help="Ensure indexes, explain the hot queries and exit")
+    parser.add_argument("--backfill-redemptions", action="store_true", help="Fill redemption summaries on user documents and exit (bot stopped)")
+    parser.add_argument("--archive", action="store_true", help="Move old used coupons and redemptions to the archives and exit")
+    args = parser.parse_args()
+
+    if args.archive:
+        asyncio.run(archive_now())
+        return
+
+    if args.backfill_redemptions:
+        asyncio.run(backfill_redemptions())
+        return
+
+    if args.check_indexes:
+        try:
+            asyncio.run(check_indexes())
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        return
+
+    if not BOT_TOKEN:
+        print("Error: BOT_TOKEN not found in environment variables!")
+        return
+    if BOT_MODE in ("webhook", "router") and not WEBHOOK_URL:
+        print(f"Error: BOT_MODE={BOT_MODE} needs WEBHOOK_URL (public https base URL)!")
+        return
+
+    if BOT_MODE == "worker" and not ROUTED_SECRET:
+        print("Error: BOT_MODE=worker is started by BOT_MODE=router, which sets ROUTED_SECRET!")
+        return
+
+    if BOT_MODE == "router":
+        asyncio.run(run_router())
+        return
+
+    # Start Bot
+    application = build_application()
+    asyncio.run(run_bot(application))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,219 @@
+import functools
+import logging
+import threading
+import time
+from pymongo import monitoring
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{str(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+# --- METRIC TYPES ---
+# Mongo command events arrive on driver threads, so every update takes a lock.
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts..., count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[-2] if series else 0
+
+    def total_count(self):
+        with self._lock:
+            return sum(series[-2] for series in self._series.values())
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for label_values, series in items:
+            for bound, bucket_count in zip(self.buckets, series):
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', bound)])} {bucket_count}"
+            yield f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', '+Inf')])} {series[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labels, label_values)} {series[-2]}"
+            yield f"{self.name}_sum{_format_labels(self.labels, label_values)} {series[-1]}"
+
+
+class CallbackGauge:
+    """Gauge whose value(s) are read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, callback, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.error(f"Gauge {self.name} failed: {e}")
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, callback, labels=()):
+        return self.register(CallbackGauge(name, help_text, callback, labels))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Time spent in each update handler", ["handler"])
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Handler calls that raised", ["handler"])
+MONGO_LATENCY = REGISTRY.histogram(
+    "bot_mongo_command_duration_seconds", "MongoDB command round trip", ["command", "collection"])
+MONGO_FAILURES = REGISTRY.counter(
+    "bot_mongo_command_failures_total", "MongoDB commands that failed", ["command", "collection"])
+TELEGRAM_LATENCY = REGISTRY.histogram(
+    "bot_telegram_api_duration_seconds", "Bot API call round trip", ["method"])
+TELEGRAM_429 = REGISTRY.counter(
+    "bot_telegram_api_429_total", "Bot API calls answered with 429 Too Many Requests", ["method"])
+TELEGRAM_ERRORS = REGISTRY.counter(
+    "bot_telegram_api_errors_total", "Bot API calls that failed at the transport level", ["method"])
+
+
+# --- HANDLER INSTRUMENTATION ---
+
+def instrumented(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+# --- MONGO COMMAND MONITORING ---
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        self._pending[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def _collection(self, event):
+        return self._pending.pop((event.connection_id, event.request_id), "")
+
+    def succeeded(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, event.command_name, self._collection(event))
+
+    def failed(self, event):
+        collection = self._collection(event)
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, event.command_name, collection)
+        MONGO_FAILURES.inc(event.command_name, collection)
+
+
+# --- BOT API INSTRUMENTATION ---
+
+class InstrumentedRequest(HTTPXRequest):
+    async def do_request(self, url, method, request_data=None, read_timeout=HTTPXRequest.DEFAULT_NONE,
+                         write_timeout=HTTPXRequest.DEFAULT_NONE, connect_timeout=HTTPXRequest.DEFAULT_NONE,
+                         pool_timeout=HTTPXRequest.DEFAULT_NONE):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+        except Exception:
+            TELEGRAM_ERRORS.inc(api_method)
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started, api_method)
+        if status == 429:
+            TELEGRAM_429.inc(api_method)
+        return status, payload
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+from copy import deepcopy
+from pymongo import DeleteOne, UpdateOne
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+class MongoPersistence(BasePersistence):
+    """PTB persistence for user_data and conversation states, stored in one collection.
+
+    Only the ids of users with saved data are read at startup; a user's data is
+    loaded the first time one of their updates is handled. Changes are compared
+    with the last saved copy, so an unchanged user_data costs nothing, and real
+    changes are written in one bulk_write per persistence run.
+    Values must be BSON-serialisable.
+    """
+
+    def __init__(self, collection, update_interval=5, flush_delay=0.5, batch_size=500):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.collection = collection
+        self._stored_users = set()
+        self._loaded_users = set()
+        self._saved = {}
+        self._pending = {}
+        self.flush_delay = flush_delay
+        self.batch_size = batch_size
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._running = False
+        self._task = None
+
+    # --- KEYS ---
+
+    @staticmethod
+    def _user_key(user_id):
+        return f"user:{user_id}"
+
+    @staticmethod
+    def _conversation_key(name, key):
+        return f"conv:{name}:{':'.join(str(part) for part in key)}"
+
+    # --- LOADING ---
+
+    async def get_user_data(self):
+        # Ids only; the data itself is pulled in refresh_user_data
+        async for doc in self.collection.find({'kind': 'user_data'}, {'_id': 0, 'user_id': 1}):
+            self._stored_users.add(doc['user_id'])
+        logger.info(f"Persistence: {len(self._stored_users)} user(s) with saved data")
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        if user_id not in self._stored_users:
+            return
+        doc = await self.collection.find_one({'_id': self._user_key(user_id)}, {'data': 1})
+        if doc and doc.get('data'):
+            user_data.update(doc['data'])
+            self._saved[user_id] = deepcopy(doc['data'])
+
+    async def get_conversations(self, name):
+        conversations = {}
+        async for doc in self.collection.find({'kind': 'conversation', 'name': name}, {'key': 1, 'state': 1}):
+            conversations[tuple(doc['key'])] = doc['state']
+        return conversations
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # --- STAGING (called by the Application every update_interval) ---
+
+    async def update_user_data(self, user_id, data):
+        if data == self._saved.get(user_id, {}):
+            return
+        key = self._user_key(user_id)
+        if data:
+            self._saved[user_id] = data
+            self._stored_users.add(user_id)
+            self._stage(key, UpdateOne(
+                {'_id': key}, {'$set': {'kind': 'user_data', 'user_id': user_id, 'data': data}}, upsert=True
+            ))
+        else:
+            await self.drop_user_data(user_id)
+
+    async def drop_user_data(self, user_id):
+        self._saved.pop(user_id, None)
+        self._stored_users.discard(user_id)
+        key = self._user_key(user_id)
+        self._stage(key, DeleteOne({'_id': key}))
+
+    async def update_conversation(self, name, key, new_state):
+        doc_id = self._conversation_key(name, key)
+        if new_state is None:
+            self._stage(doc_id, DeleteOne({'_id': doc_id}))
+        else:
+            self._stage(doc_id, UpdateOne(
+                {'_id': doc_id},
+                {'$set': {'kind': 'conversation', 'name': name, 'key': list(key), 'state': new_state}},
+                upsert=True
+            ))
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    # --- WRITE-BEHIND ---
+
+    def _stage(self, doc_id, operation):
+        # Latest write per document wins; the flusher writes `flush_delay` after the
+        # first staged write, or as soon as `batch_size` writes are waiting
+        self._pending[doc_id] = operation
+        if self._task is None:
+            self._running = True
+            self._task = asyncio.create_task(self._flush_loop())
+        self._wake.set()
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    async def _write(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await self.collection.bulk_write(list(batch.values()), ordered=False)
+        except Exception as e:
+            logger.error(f"Persistence flush of {len(batch)} write(s) failed: {e}")
+            # Retried on the next run unless a newer write for the same document is already staged
+            for doc_id, operation in batch.items():
+                self._pending.setdefault(doc_id, operation)
+
+    async def _flush_loop(self):
+        while self._running:
+            await self._wake.wait()
+            try:
+                # Debounced, so one persistence run touching many users is one bulk_write
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            self._full.clear()
+            await self._write()
+
+    async def flush(self):
+        # Called by Application.shutdown() after the final update run
+        if self._task:
+            self._running = False
+            self._wake.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        await self._write()
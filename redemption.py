@@ -0,0 +1,230 @@
+import asyncio
+import datetime
+import logging
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Redemptions kept on the user document for the Balance view
+RECENT_REDEMPTIONS = 5
+
+
+class RedemptionFailed(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class RedemptionEngine:
+    """Debits the balance, claims a coupon and records the redemption as one unit.
+
+    On a replica set / sharded cluster the three writes run in one transaction.
+    On a standalone server the debit is compensated if no coupon can be claimed;
+    once one is, the user gets it even if writing the history fails.
+    """
+
+    def __init__(self, client, users_col, coupons_col, redeemed_col, mode="auto", pool=None):
+        self.client = client
+        self.users_col = users_col
+        self.coupons_col = coupons_col
+        self.redeemed_col = redeemed_col
+        self.mode = mode
+        self.pool = pool
+        self._use_transactions = None
+
+    async def uses_transactions(self):
+        if self._use_transactions is None:
+            if self.mode == "transaction":
+                self._use_transactions = True
+            elif self.mode == "compensate":
+                self._use_transactions = False
+            else:
+                hello = await self.client.admin.command("hello")
+                self._use_transactions = bool(hello.get("setName") or hello.get("msg") == "isdbgrid")
+            logger.info(f"Redemptions use {'transactions' if self._use_transactions else 'compensation'}")
+        return self._use_transactions
+
+    # --- STEPS ---
+
+    async def _debit(self, user_id, cost, session=None):
+        # Guarded $inc: the balance can never go below zero
+        return await self.users_col.find_one_and_update(
+            {'user_id': user_id, 'balance': {'$gte': cost}},
+            {'$inc': {'balance': -float(cost)}},
+            projection={'balance': 1},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+
+    async def _claim(self, user_id, amount, now, session=None, taken=None):
+        update = {'$set': {'is_used': True, 'used_by': user_id, 'used_at': now, 'reserved_by': None}}
+
+        # Pre-reserved coupons are claimed by _id, no contention with other requests
+        while self.pool:
+            reserved = self.pool.take(amount)
+            if reserved is None:
+                break
+            if taken is not None:
+                taken.append(reserved)
+            coupon = await self.coupons_col.find_one_and_update(
+                {'_id': reserved['_id'], 'reserved_by': self.pool.worker_id, 'is_used': False},
+                update,
+                projection={'code': 1},
+                session=session
+            )
+            if coupon:
+                return coupon
+            if taken is not None:
+                # Deleted or reclaimed meanwhile: nothing to hand back
+                taken.remove(reserved)
+
+        coupon = await self.coupons_col.find_one_and_update(
+            {'amount': amount, 'is_used': False, 'reserved_by': None},
+            update,
+            projection={'code': 1},
+            session=session
+        )
+        if coupon or not self.pool:
+            return coupon
+        # The unreserved stock is gone but other workers' pools may still hold some:
+        # take one of theirs; its owner skips it when the claim by _id misses
+        return await self.coupons_col.find_one_and_update(
+            {'amount': amount, 'is_used': False},
+            update,
+            projection={'code': 1},
+            session=session
+        )
+
+    async def _record(self, user_id, code, amount, now, session=None):
+        history = self.redeemed_col.insert_one({
+            'user_id': user_id,
+            'code': code,
+            'amount': amount,
+            'redeemed_at': now
+        }, session=session)
+        # Denormalized summary so the Balance view is a single document fetch
+        summary = self.users_col.update_one(
+            {'user_id': user_id},
+            {
+                '$inc': {'redeemed_count': 1},
+                '$push': {'recent_redemptions': {
+                    '$each': [{'code': code, 'amount': amount, 'redeemed_at': now}],
+                    '$position': 0,
+                    '$slice': RECENT_REDEMPTIONS
+                }}
+            },
+            session=session
+        )
+        if session is None:
+            await asyncio.gather(history, summary)
+        else:
+            # Operations within one session must not overlap
+            await history
+            await summary
+
+    # --- PIPELINES ---
+
+    async def redeem(self, user_id, cost, amount):
+        """Returns (code, new_balance, status)."""
+        try:
+            if await self.uses_transactions():
+                code, balance = await self._redeem_in_transaction(user_id, cost, amount)
+            else:
+                code, balance = await self._redeem_with_compensation(user_id, cost, amount)
+        except RedemptionFailed as e:
+            return None, None, e.status
+        return code, balance, "success"
+
+    async def _redeem_in_transaction(self, user_id, cost, amount):
+        result = {}
+        # Pool coupons taken by attempts that rolled back are still reserved by us
+        taken = []
+
+        async def body(session):
+            now = datetime.datetime.now()
+            user = await self._debit(user_id, cost, session)
+            if not user:
+                raise RedemptionFailed("insufficient_balance")
+            coupon = await self._claim(user_id, amount, now, session, taken)
+            if not coupon:
+                raise RedemptionFailed("out_of_stock")
+            await self._record(user_id, coupon['code'], amount, now, session)
+            result['coupon_id'] = coupon['_id']
+            result['code'] = coupon['code']
+            result['balance'] = user['balance']
+
+        # with_transaction retries on write conflicts (e.g. a double-tapped button)
+        try:
+            async with await self.client.start_session() as session:
+                await session.with_transaction(body)
+        except BaseException:
+            for reserved in taken:
+                self.pool.give_back(amount, reserved)
+            raise
+
+        for reserved in taken:
+            if reserved['_id'] != result['coupon_id']:
+                self.pool.give_back(amount, reserved)
+        return result['code'], result['balance']
+
+    async def _redeem_with_compensation(self, user_id, cost, amount):
+        now = datetime.datetime.now()
+        user = await self._debit(user_id, cost)
+        if not user:
+            raise RedemptionFailed("insufficient_balance")
+
+        taken = []
+        try:
+            coupon = await self._claim(user_id, amount, now, taken=taken)
+        except Exception:
+            # If the claim did land, the coupon is used and a later claim by _id just skips it
+            for reserved in taken:
+                self.pool.give_back(amount, reserved)
+            await self._refund(user_id, cost)
+            raise
+        if not coupon:
+            await self._refund(user_id, cost)
+            raise RedemptionFailed("out_of_stock")
+
+        try:
+            await self._record(user_id, coupon['code'], amount, now)
+        except Exception as e:
+            # Debited and claimed already: the user still gets their code, the history is fixed by hand
+            logger.error(f"Redemption not recorded, reconcile manually: user_id={user_id} code={coupon['code']} "
+                         f"amount={amount} redeemed_at={now.isoformat()} error={e!r}")
+        return coupon['code'], user['balance']
+
+    async def _refund(self, user_id, cost):
+        await self.users_col.update_one({'user_id': user_id}, {'$inc': {'balance': float(cost)}})
+
+
+async def backfill_redemption_summaries(users_col, redeemed_col, batch_size=1000, archives=()):
+    """Fill redeemed_count / recent_redemptions for existing users from `redeemed` and its archives.
+
+    Run it with the bot stopped: a redemption landing between the aggregate
+    and the write would be missing from recent_redemptions. The count is
+    written with $max, so it at least never goes backwards.
+    """
+    pipeline = [{'$unionWith': name} for name in archives] + [
+        {'$sort': {'user_id': 1, 'redeemed_at': -1}},
+        {'$group': {
+            '_id': '$user_id',
+            'count': {'$sum': 1},
+            'recent': {'$push': {'code': '$code', 'amount': '$amount', 'redeemed_at': '$redeemed_at'}},
+        }},
+        {'$project': {'count': 1, 'recent': {'$slice': ['$recent', RECENT_REDEMPTIONS]}}},
+    ]
+    updated = 0
+    ops = []
+    # Streamed cursor: only one batch of results is held here at a time
+    async for row in redeemed_col.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size):
+        ops.append(UpdateOne(
+            {'user_id': row['_id']},
+            {'$max': {'redeemed_count': row['count']}, '$set': {'recent_redemptions': row['recent']}}
+        ))
+        if len(ops) >= batch_size:
+            updated += (await users_col.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+    if ops:
+        updated += (await users_col.bulk_write(ops, ordered=False)).modified_count
+    return updated
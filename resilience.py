@@ -0,0 +1,195 @@
+import asyncio
+import functools
+import logging
+import random
+import time
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, WTimeoutError
+from telegram.error import NetworkError
+from metrics import REGISTRY, InstrumentedRequest
+
+logger = logging.getLogger(__name__)
+
+# What a database outage looks like from a handler; DuplicateKeyError and
+# other OperationFailures mean Mongo answered and are not counted
+MONGO_OUTAGE_ERRORS = (ConnectionFailure, ExecutionTimeout, WTimeoutError, asyncio.TimeoutError)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} circuit open, next probe in {retry_in:.0f}s")
+        self.name = name
+
+
+# Everything a handler should treat as "dependency unavailable, degrade"
+UNAVAILABLE_ERRORS = (CircuitOpenError,) + MONGO_OUTAGE_ERRORS
+
+
+class CircuitBreaker:
+    """Fails calls fast once a dependency keeps failing.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    are rejected without being attempted. Once `reset_timeout` seconds have
+    passed a single probe is let through: success closes the circuit, failure
+    opens it for another `reset_timeout`.
+    """
+
+    def __init__(self, name, failure_types=MONGO_OUTAGE_ERRORS, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_types = failure_types
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = None
+        self._probing = False
+
+    @property
+    def available(self):
+        """Whether a call would be attempted right now; no side effects."""
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not (self.state == HALF_OPEN and self._probing)
+
+    def allow(self):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probing = False
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def success(self):
+        if self.state != CLOSED:
+            logger.info(f"Circuit {self.name} closed")
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def failure(self, error=None):
+        self.failures += 1
+        self.last_error = repr(error) if error is not None else None
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"Circuit {self.name} opened after {self.failures} failure(s): {self.last_error}")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        # The probe ended without telling us anything (cancelled, or an unrelated error)
+        if self.state == HALF_OPEN:
+            self._probing = False
+
+    def open_error(self):
+        return CircuitOpenError(self.name, max(self.reset_timeout - (time.monotonic() - self.opened_at), 0))
+
+    async def call(self, func, *args, timeout=None, retries=0, **kwargs):
+        """Run func through the breaker; only pass retries for idempotent calls."""
+        for attempt in range(retries + 1):
+            if not self.allow():
+                raise self.open_error()
+            try:
+                if timeout:
+                    result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+                else:
+                    result = await func(*args, **kwargs)
+            except self.failure_types as e:
+                self.failure(e)
+                if attempt == retries:
+                    raise
+                # Full jitter, so a burst of failed reads does not come back in lockstep
+                await asyncio.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+            except BaseException:
+                # Mongo answered (or we were cancelled): the dependency is not at fault
+                self.release()
+                raise
+            else:
+                self.success()
+                return result
+
+    def snapshot(self):
+        return {'state': self.state, 'failures': self.failures, 'last_error': self.last_error}
+
+
+# --- MONGO ---
+
+class GuardedCollection:
+    """A Motor collection whose awaitable calls go through a circuit breaker.
+
+    Reads get a short timeout and jittered retries; writes are attempted once
+    and bounded by the client's server selection timeout, since a cancelled
+    write may still land. Cursors (find, aggregate, watch) pass through.
+    """
+
+    READS = frozenset({'find_one', 'count_documents', 'estimated_document_count', 'distinct'})
+    WRITES = frozenset({'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one',
+                        'delete_one', 'delete_many', 'find_one_and_update', 'find_one_and_delete',
+                        'find_one_and_replace', 'bulk_write'})
+
+    def __init__(self, collection, breaker, read_timeout=2.0, read_retries=2):
+        self.unguarded = collection
+        self.breaker = breaker
+        self.read_timeout = read_timeout
+        self.read_retries = read_retries
+
+    def __getattr__(self, name):
+        attr = getattr(self.unguarded, name)
+        if name in self.READS:
+            return functools.partial(self._read, attr)
+        if name in self.WRITES:
+            return functools.partial(self.breaker.call, attr)
+        return attr
+
+    def __getitem__(self, name):
+        return self.unguarded[name]
+
+    async def _read(self, method, *args, **kwargs):
+        # Never retried inside a session: a transaction retries as a whole
+        retries = 0 if kwargs.get('session') else self.read_retries
+        return await self.breaker.call(method, *args, timeout=self.read_timeout, retries=retries, **kwargs)
+
+
+# --- BOT API ---
+
+class GuardedRequest(InstrumentedRequest):
+    """Bot API transport behind a breaker: timeouts, network errors and 5xx count as failures."""
+
+    def __init__(self, breaker, **kwargs):
+        super().__init__(**kwargs)
+        self.breaker = breaker
+
+    async def do_request(self, url, method, request_data=None, read_timeout=InstrumentedRequest.DEFAULT_NONE,
+                         write_timeout=InstrumentedRequest.DEFAULT_NONE, connect_timeout=InstrumentedRequest.DEFAULT_NONE,
+                         pool_timeout=InstrumentedRequest.DEFAULT_NONE):
+        if not self.breaker.allow():
+            # A NetworkError so PTB and the handlers treat it like any other transport failure
+            raise NetworkError(str(self.breaker.open_error()))
+        try:
+            status, payload = await super().do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+        except NetworkError as e:
+            self.breaker.failure(e)
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        if status >= 500:
+            self.breaker.failure(f"HTTP {status}")
+        else:
+            self.breaker.success()
+        return status, payload
+
+
+# --- REPORTING ---
+
+def register_breakers(breakers):
+    REGISTRY.gauge("bot_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+                   lambda: {b.name: _STATE_VALUES[b.state] for b in breakers}, ["breaker"])
@@ -0,0 +1,174 @@
+import asyncio
+import hmac
+import logging
+import os
+import signal
+import sys
+import aiohttp
+from aiohttp import web
+from coordination import shard_of
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def update_user_id(data):
+    """The user an update belongs to, read from the raw JSON without building PTB objects."""
+    for key, value in data.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        if key == 'chat_member':
+            # The member who joined/left, not the admin who changed them: their shard caches the fsub result
+            return value.get('new_chat_member', {}).get('user', {}).get('id')
+        user = value.get('from') or value.get('user')
+        if user:
+            return user.get('id')
+        chat = value.get('chat')
+        if chat:
+            return chat.get('id')
+    return None
+
+
+def shard_for(data, shard_count):
+    user_id = update_user_id(data)
+    return shard_of(user_id, shard_count) if user_id is not None else 0
+
+
+class UpdateRouter:
+    """Forwards raw updates to worker processes, sharded by user id.
+
+    Each shard has one queue and one forwarding task posting batches in
+    arrival order, so a user's updates reach their worker in order. A worker
+    that is down holds up its own shard only; its batch is retried until the
+    worker is back.
+    """
+
+    def __init__(self, worker_urls, secret="", batch_size=100, retry_delay=1.0):
+        self.worker_urls = list(worker_urls)
+        self.secret = secret
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.queues = [asyncio.Queue() for _ in self.worker_urls]
+        self.forwarded = [0] * len(self.worker_urls)
+        self._session = None
+        self._tasks = []
+
+    def submit(self, data):
+        self.queues[shard_for(data, len(self.queues))].put_nowait(data)
+
+    async def _forward(self, shard):
+        queue, url = self.queues[shard], self.worker_urls[shard]
+        headers = {SECRET_HEADER: self.secret} if self.secret else {}
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            while True:
+                try:
+                    async with self._session.post(url, json=batch, headers=headers) as response:
+                        if response.status == 200:
+                            break
+                        logger.error(f"Shard {shard} refused {len(batch)} update(s): HTTP {response.status}")
+                except aiohttp.ClientError as e:
+                    logger.error(f"Shard {shard} unreachable: {e}")
+                await asyncio.sleep(self.retry_delay)
+            self.forwarded[shard] += len(batch)
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        self._tasks = [asyncio.create_task(self._forward(shard)) for shard in range(len(self.queues))]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    def status(self):
+        return [{'shard': shard, 'queued': queue.qsize(), 'forwarded': self.forwarded[shard]}
+                for shard, queue in enumerate(self.queues)]
+
+
+# --- FRONT WEB APP ---
+
+async def _webhook(request):
+    secret = request.app['webhook_secret']
+    if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, '').encode(), secret.encode()):
+        return web.Response(status=403)
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    request.app['router'].submit(data)
+    return web.Response()
+
+
+async def _health(request):
+    return web.json_response({
+        'status': 'ok',
+        'message': "Router is alive! 💎 High Speed Mode ON",
+        'shards': request.app['router'].status(),
+    })
+
+
+def build_router_app(router, webhook_path, webhook_secret=""):
+    web_app = web.Application()
+    web_app['router'] = router
+    web_app['webhook_secret'] = webhook_secret
+    web_app.router.add_get('/', _health)
+    web_app.router.add_post(webhook_path, _webhook)
+    return web_app
+
+
+# --- WORKER PROCESSES ---
+
+class WorkerSupervisor:
+    """Runs `main.py` once per shard with BOT_MODE=worker and restarts workers that exit.
+
+    Workers listen on 127.0.0.1 only and accept batches carrying
+    `routed_secret`, which the router hands them in their environment.
+    """
+
+    def __init__(self, shard_count, base_port, script, worker_prefix, routed_secret, restart_delay=2.0):
+        self.shard_count = shard_count
+        self.base_port = base_port
+        self.script = script
+        self.worker_prefix = worker_prefix
+        self.routed_secret = routed_secret
+        self.restart_delay = restart_delay
+        self._processes = {}
+        self._tasks = []
+        self._stopping = False
+
+    def url(self, shard, path):
+        return f"http://127.0.0.1:{self.base_port + shard}{path}"
+
+    async def _spawn(self, shard):
+        env = dict(os.environ, BOT_MODE="worker", PORT=str(self.base_port + shard),
+                   SHARD_INDEX=str(shard), SHARD_COUNT=str(self.shard_count), ROUTED_SECRET=self.routed_secret,
+                   # Stable per shard as long as the prefix is (WORKER_ID or the hostname), so a
+                   # restarted worker or router takes back the shard's own coupon reservations
+                   WORKER_ID=f"{self.worker_prefix}:shard{shard}")
+        return await asyncio.create_subprocess_exec(sys.executable, self.script, env=env)
+
+    async def _keep_alive(self, shard):
+        while not self._stopping:
+            process = self._processes[shard] = await self._spawn(shard)
+            code = await process.wait()
+            if not self._stopping:
+                logger.error(f"Worker {shard} exited with {code}, restarting")
+                await asyncio.sleep(self.restart_delay)
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._keep_alive(shard)) for shard in range(self.shard_count)]
+
+    async def stop(self):
+        self._stopping = True
+        for process in self._processes.values():
+            if process.returncode is None:
+                process.send_signal(signal.SIGTERM)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,132 @@
+import asyncio
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StatsEngine:
+    """In-memory user/coupon counters, kept current by the write paths and
+    periodically reconciled against MongoDB (archived coupons included)."""
+
+    def __init__(self, users_col, coupons_col, denominations, reconcile_interval=300, archiver=None):
+        self.users_col = users_col
+        self.coupons_col = coupons_col
+        self.archiver = archiver
+        self.denominations = list(denominations)
+        self.reconcile_interval = reconcile_interval
+
+        self.total_users = 0
+        self.active_today = 0
+        self.total_coupons = 0
+        self.used_coupons = 0
+        self.stock = {amount: 0 for amount in self.denominations}
+
+        self.last_reconciled = None
+        self._day = datetime.date.today()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    # --- INCREMENTAL UPDATES ---
+
+    def on_user_added(self):
+        self.total_users += 1
+        self.active_today += 1
+
+    def on_coupons_added(self, amount, count):
+        self.total_coupons += count
+        self.stock[amount] = self.stock.get(amount, 0) + count
+
+    def on_coupons_deleted(self, breakdown):
+        # breakdown: {(amount, is_used): count}
+        for (amount, is_used), count in breakdown.items():
+            self.total_coupons -= count
+            if is_used:
+                self.used_coupons -= count
+            else:
+                self.stock[amount] = max(self.stock.get(amount, 0) - count, 0)
+
+    def on_coupon_redeemed(self, amount):
+        self.used_coupons += 1
+        self.stock[amount] = max(self.stock.get(amount, 0) - 1, 0)
+
+    # --- RECONCILIATION ---
+
+    async def reconcile(self):
+        async with self._lock:
+            today_start = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+            coupon_facets = self.coupons_col.aggregate([
+                {'$facet': {
+                    'total': [{'$count': 'n'}],
+                    'by_state': [
+                        {'$group': {'_id': {'amount': '$amount', 'is_used': '$is_used'}, 'n': {'$sum': 1}}}
+                    ],
+                }}
+            ]).to_list(length=1)
+            total_users, active_today, facets, archived = await asyncio.gather(
+                self.users_col.estimated_document_count(),
+                self.users_col.count_documents({'last_active': {'$gte': today_start}}),
+                coupon_facets,
+                self._archived_coupons(),
+            )
+
+            facet = facets[0] if facets else {}
+            total = facet.get('total') or [{'n': 0}]
+            stock = {amount: 0 for amount in self.denominations}
+            used = 0
+            for row in facet.get('by_state', []):
+                if row['_id'].get('is_used'):
+                    used += row['n']
+                else:
+                    amount = row['_id'].get('amount')
+                    stock[amount] = stock.get(amount, 0) + row['n']
+
+            self.total_users = total_users
+            self.active_today = active_today
+            # Archived coupons are all used ones that left the hot collection
+            self.total_coupons = total[0]['n'] + archived
+            self.used_coupons = used + archived
+            self.stock = stock
+            self._day = today_start.date()
+            self.last_reconciled = datetime.datetime.now()
+
+    async def _archived_coupons(self):
+        if self.archiver is None:
+            return 0
+        return await self.archiver.archived_total('coupons')
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Stats reconcile failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._reconcile_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # --- READ ---
+
+    async def snapshot(self):
+        if self.last_reconciled is None or datetime.date.today() != self._day:
+            await self.reconcile()
+        available = sum(self.stock.values())
+        return {
+            'total_users': self.total_users,
+            'active_today': self.active_today,
+            'total_coupons': self.total_coupons,
+            'used_coupons': self.used_coupons,
+            'available_coupons': available,
+            'stock': dict(self.stock),
+        }
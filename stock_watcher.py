@@ -0,0 +1,182 @@
+import asyncio
+import datetime
+import logging
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class StockWatcher:
+    """Unused-coupon counts per denomination, kept current from the coupons change stream.
+
+    Inserts and coupons flipping to `is_used` are applied as they happen, so
+    redemptions made by any worker show up within moments. Deletes and
+    anything unexpected trigger a recount. Without change streams (standalone
+    mongod) the counts are recounted every `poll_interval` seconds instead.
+
+    Low-stock alerts fire when a count crosses the watermark, not for stock
+    that was already low at startup. With `alerts_col`, a per-denomination
+    flag there makes one process send each alert however many are running.
+    """
+
+    def __init__(self, coupons_col, denominations, low_watermark=20, poll_interval=15,
+                 reconcile_interval=300, on_low=None, alerts_col=None):
+        self.coupons_col = coupons_col
+        self.denominations = list(denominations)
+        self.low_watermark = low_watermark
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        self.on_low = on_low
+        self.alerts_col = alerts_col
+        self.stock = {amount: 0 for amount in self.denominations}
+        self.streaming = False
+        self._polling = False
+        self._low = set()
+        self._seeded = False
+        self._crossings = []
+        self._running = False
+        self._task = None
+
+    # --- COUNTS ---
+
+    async def recount(self):
+        # One index-only count per denomination
+        counts = await asyncio.gather(*(
+            self.coupons_col.count_documents({'amount': amount, 'is_used': False})
+            for amount in self.denominations
+        ))
+        self.stock = dict(zip(self.denominations, counts))
+        if not self._seeded:
+            # Stock already low at startup was alerted when it crossed, not on every restart
+            self._low = {amount for amount in self.denominations if self.stock[amount] <= self.low_watermark}
+            self._seeded = True
+            return
+        for amount in self.denominations:
+            self._check_low(amount)
+        await self._send_alerts()
+
+    def _adjust(self, amount, delta):
+        if amount not in self.stock:
+            return
+        self.stock[amount] = max(self.stock[amount] + delta, 0)
+        self._check_low(amount)
+
+    def _check_low(self, amount):
+        # One alert per crossing; climbing back above the watermark re-arms it
+        count = self.stock[amount]
+        if count <= self.low_watermark:
+            if amount not in self._low:
+                self._low.add(amount)
+                self._crossings.append((amount, True, count))
+        elif amount in self._low:
+            self._low.discard(amount)
+            self._crossings.append((amount, False, count))
+
+    async def _claim_alert(self, amount):
+        if self.alerts_col is None:
+            return True
+        try:
+            result = await self.alerts_col.update_one(
+                {'_id': amount, 'low': {'$ne': True}},
+                {'$set': {'low': True, 'alerted_at': datetime.datetime.now()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Already flagged low: another process sent this alert
+            return False
+        return bool(result.modified_count or result.upserted_id is not None)
+
+    async def _send_alerts(self):
+        crossings, self._crossings = self._crossings, []
+        for amount, low, count in crossings:
+            try:
+                if not low:
+                    if self.alerts_col is not None:
+                        await self.alerts_col.update_one({'_id': amount, 'low': True}, {'$set': {'low': False}})
+                elif await self._claim_alert(amount) and self.on_low:
+                    self.on_low(amount, count)
+            except Exception as e:
+                logger.error(f"Low-stock alert for {amount} failed: {e}")
+
+    def available(self):
+        return [amount for amount in self.denominations if self.stock.get(amount, 0) > 0]
+
+    # --- CHANGE STREAM ---
+
+    def _apply(self, change):
+        operation = change['operationType']
+        if operation == 'insert':
+            doc = change['fullDocument']
+            if not doc.get('is_used'):
+                self._adjust(doc.get('amount'), 1)
+            return True
+        if operation == 'update':
+            doc = change.get('fullDocument')
+            if doc is not None:
+                self._adjust(doc.get('amount'), -1)
+                return True
+        # Deletes carry no document, and drops/replaces are rare: recount
+        return False
+
+    async def _watch(self):
+        pipeline = [{'$match': {'$or': [
+            {'operationType': {'$in': ['insert', 'delete', 'replace', 'drop', 'rename', 'invalidate']}},
+            {'operationType': 'update', 'updateDescription.updatedFields.is_used': True},
+        ]}}]
+        loop = asyncio.get_running_loop()
+        async with self.coupons_col.watch(pipeline, full_document='updateLookup', max_await_time_ms=1000) as stream:
+            # Counted after the stream is open: a change may be counted twice, never missed
+            await self.recount()
+            last_recount = loop.time()
+            logger.info("Stock counts follow the coupons change stream")
+            self.streaming = True
+            self._polling = False
+            dirty = False
+            while self._running and stream.alive:
+                change = await stream.try_next()
+                if change is not None and not self._apply(change):
+                    dirty = True
+                if self._crossings:
+                    await self._send_alerts()
+                if dirty and change is None:
+                    # Once the burst is drained: an archive run deletes thousands of coupons at once
+                    await self.recount()
+                    last_recount = loop.time()
+                    dirty = False
+                if loop.time() - last_recount > self.reconcile_interval:
+                    # Catches drift from events applied on top of an overlapping count
+                    await self.recount()
+                    last_recount = loop.time()
+
+    async def _run(self):
+        while self._running:
+            try:
+                await self._watch()
+            except Exception as e:
+                if not self._polling:
+                    logger.warning(f"Coupons change stream unavailable ({e}), polling every {self.poll_interval}s")
+                self.streaming = False
+                self._polling = True
+            if not self._running:
+                break
+            try:
+                await self.recount()
+            except Exception as e:
+                logger.error(f"Stock recount failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def start(self):
+        await self.recount()
+        if self._task is None:
+            self._running = True
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._running = False
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
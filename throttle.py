@@ -0,0 +1,91 @@
+import time
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+from cache import TTLCache
+from metrics import REGISTRY
+
+THROTTLED = REGISTRY.counter(
+    "bot_throttled_updates_total", "Updates shed by per-user flood control", ["budget", "reply"])
+
+
+class TokenBuckets:
+    """Per-key token buckets: `burst` tokens, refilled at `rate` per second.
+
+    A bucket left alone long enough to refill completely expires, and a
+    missing bucket counts as full. Expired buckets are dropped on the user's
+    next update or pushed out by newer ones once the cache is full, so
+    memory stays bounded without a sweeper.
+    """
+
+    def __init__(self, rate, burst, maxsize=100_000):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = TTLCache(maxsize, burst / rate)
+
+    def take(self, key):
+        now = time.monotonic()
+        entry = self.buckets.peek(key)
+        if entry is None:
+            tokens = self.burst
+        else:
+            tokens, last = entry
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            return False
+        tokens -= 1
+        # Expires once the bucket would be full again
+        self.buckets.set(key, (tokens, now), ttl=(self.burst - tokens) / self.rate)
+        return True
+
+
+class FloodControl:
+    """Sheds a user's excess updates before any handler touches Mongo or the Bot API.
+
+    Menu taps and other cheap views draw on one budget; redemptions and
+    /start with a referral draw on a smaller one. A throttled user is told to
+    slow down once per `notice_interval`; anything past that is dropped
+    without a single API call.
+    """
+
+    def __init__(self, menu_rate, menu_burst, action_rate, action_burst,
+                 exempt_ids=(), notice_interval=10, cache_size=100_000):
+        # A rate of 0 switches that budget off
+        self.budgets = {}
+        if menu_rate > 0:
+            self.budgets['menu'] = TokenBuckets(menu_rate, menu_burst, cache_size)
+        if action_rate > 0:
+            self.budgets['action'] = TokenBuckets(action_rate, action_burst, cache_size)
+        self.exempt_ids = set(exempt_ids)
+        self.notified = TTLCache(cache_size, notice_interval)
+
+    @staticmethod
+    def budget_for(update):
+        query = update.callback_query
+        if query:
+            return 'action' if (query.data or '').startswith('redeem_') else 'menu'
+        message = update.message
+        if message:
+            text = message.text or ''
+            # A bare /start only shows the menu; with an argument it may credit a referral
+            return 'action' if text.startswith('/start ') else 'menu'
+        return None
+
+    async def __call__(self, update: Update, context):
+        # chat_member / my_chat_member updates are never user-driven spam
+        user = update.effective_user
+        if user is None or user.id in self.exempt_ids:
+            return
+        budget = self.budget_for(update)
+        if budget not in self.budgets or self.budgets[budget].take(user.id):
+            return
+
+        if (budget, user.id) in self.notified:
+            THROTTLED.inc(budget, 'silent')
+        else:
+            self.notified.set((budget, user.id), True)
+            THROTTLED.inc(budget, 'notice')
+            if update.callback_query:
+                await update.callback_query.answer("⏳ Too many taps, please wait a few seconds.")
+            else:
+                await update.message.reply_text("⏳ You're going too fast, please wait a few seconds.")
+        raise ApplicationHandlerStop
@@ -0,0 +1,87 @@
+from pymongo import ReturnDocument
+from cache import TTLCache
+
+
+class UserProfile:
+    """The slice of a user document the handlers read, without the BSON dict overhead."""
+
+    __slots__ = ('user_id', 'first_name', 'balance', 'referral_count', 'redeemed_count',
+                 'recent_redemptions', 'referred_by', 'is_banned')
+
+    FIELDS = __slots__
+    PROJECTION = {field: 1 for field in FIELDS}
+
+    def __init__(self, doc):
+        self.user_id = doc.get('user_id')
+        self.first_name = doc.get('first_name')
+        self.balance = doc.get('balance', 0.0)
+        self.referral_count = doc.get('referral_count', 0)
+        self.redeemed_count = doc.get('redeemed_count', 0)
+        self.recent_redemptions = doc.get('recent_redemptions') or []
+        self.referred_by = doc.get('referred_by')
+        self.is_banned = doc.get('is_banned', False)
+
+    def get(self, key, default=None):
+        # Lets handlers keep reading profiles like the documents they replace
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+
+class UserCache:
+    """Read-through cache in front of users_col with write-through from balance changes."""
+
+    def __init__(self, users_col, maxsize=50_000, ttl=300, recent_limit=5):
+        self.users_col = users_col
+        self.recent_limit = recent_limit
+        # Expired profiles are kept for stale(), served while Mongo is unreachable
+        self.profiles = TTLCache(maxsize, ttl, keep_stale=True)
+
+    @property
+    def hits(self):
+        return self.profiles.hits
+
+    @property
+    def misses(self):
+        return self.profiles.misses
+
+    async def get(self, user_id):
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            return profile
+        doc = await self.users_col.find_one({'user_id': user_id}, UserProfile.PROJECTION)
+        if doc is None:
+            return None
+        profile = UserProfile(doc)
+        self.profiles.set(user_id, profile)
+        return profile
+
+    def stale(self, user_id):
+        # Degraded mode: the last profile we saw, however old
+        return self.profiles.stale(user_id)
+
+    def put(self, doc):
+        profile = UserProfile(doc)
+        self.profiles.set(profile.user_id, profile)
+        return profile
+
+    def invalidate(self, user_id):
+        self.profiles.pop(user_id)
+
+    # --- WRITE-THROUGH ---
+
+    async def update(self, filter, update):
+        """Apply an update and refresh the cached profile from the returned document."""
+        doc = await self.users_col.find_one_and_update(
+            filter, update, projection=UserProfile.PROJECTION, return_document=ReturnDocument.AFTER
+        )
+        if doc is not None and doc.get('user_id') in self.profiles:
+            self.put(doc)
+        return doc
+
+    def on_redeemed(self, user_id, balance, entry):
+        profile = self.profiles.peek(user_id)
+        if profile is None:
+            return
+        profile.balance = balance
+        profile.redeemed_count += 1
+        profile.recent_redemptions = ([entry] + profile.recent_redemptions)[:self.recent_limit]
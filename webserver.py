@@ -0,0 +1,77 @@
+import hmac
+import logging
+from aiohttp import web
+from telegram import Update
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# --- ROUTES ---
+
+async def health_check(request):
+    # Always 200 while the process runs: an outage upstream is not a reason to restart us
+    breakers = {b.name: b.snapshot() for b in request.app['breakers']}
+    degraded = any(b['state'] != 'closed' for b in breakers.values())
+    return web.json_response({
+        'status': 'degraded' if degraded else 'ok',
+        'message': "Bot is alive! 💎 High Speed Mode ON",
+        'breakers': breakers,
+    })
+
+async def metrics_endpoint(request):
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+async def telegram_webhook(request):
+    secret = request.app['webhook_secret']
+    if secret and not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', '').encode(), secret.encode()):
+        return web.Response(status=403)
+
+    application = request.app['bot_app']
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+
+    # Handed to the Application's own queue on this same event loop
+    await application.update_queue.put(Update.de_json(data, application.bot))
+    return web.Response()
+
+async def routed_updates(request):
+    # Batches from the router (BOT_MODE=router), already in per-user order.
+    # Always authenticated: a forged batch could act as any user, admins included
+    secret = request.app['routed_secret']
+    if not secret or not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', '').encode(), secret.encode()):
+        return web.Response(status=403)
+
+    application = request.app['bot_app']
+    try:
+        batch = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    for data in batch:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    return web.Response()
+
+# --- SERVER ---
+
+def build_web_app(application, webhook_path=None, webhook_secret=None, breakers=(), routed_path=None, routed_secret=None):
+    web_app = web.Application()
+    web_app['bot_app'] = application
+    web_app['webhook_secret'] = webhook_secret
+    web_app['routed_secret'] = routed_secret
+    web_app['breakers'] = list(breakers)
+    web_app.router.add_get('/', health_check)
+    web_app.router.add_get('/metrics', metrics_endpoint)
+    if webhook_path:
+        web_app.router.add_post(webhook_path, telegram_webhook)
+    if routed_path:
+        web_app.router.add_post(routed_path, routed_updates)
+    return web_app
+
+async def start_web_server(web_app, port, host="0.0.0.0"):
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    logger.info(f"Web server listening on {host}:{port}")
+    return runner